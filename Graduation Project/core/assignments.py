@@ -0,0 +1,110 @@
+import time
+
+HOSTS_KEY = "core:hosts"  # host id → sid of its current connection
+ASSIGNMENTS_KEY = "core:assignments"  # sha256 → host id
+DEADLINES_KEY = "core:deadlines"  # sha256 scored by its deadline (unix time)
+DISPATCHED_KEY = "core:dispatched"  # sha256 → unix time it was sent to its host
+
+# Forget a host only if it has not reconnected with a new sid meanwhile
+UNREGISTER_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+# Complete an assignment if it still belongs to the host; returns the
+# time it was dispatched
+FINISH_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    local dispatched = redis.call('HGET', KEYS[3], ARGV[1])
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    return dispatched or '0'
+end
+return false
+"""
+
+# Take every assignment past its deadline; returns sha256, host id pairs
+EXPIRE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local taken = {}
+for _, sha256 in ipairs(expired) do
+    local host = redis.call('HGET', KEYS[1], sha256)
+    redis.call('ZREM', KEYS[2], sha256)
+    redis.call('HDEL', KEYS[1], sha256)
+    redis.call('HDEL', KEYS[3], sha256)
+    table.insert(taken, sha256)
+    table.insert(taken, host or '')
+end
+return taken
+"""
+
+
+class AssignmentTable:
+    """
+    Samples out for analysis, shared by every core through Redis.
+
+    Assignments are keyed by the host's id rather than its Socket.IO sid,
+    so a host that reconnects (to the same or another core) still owns its
+    samples. Finishing and expiring are single Redis scripts, so exactly
+    one core acts on each assignment.
+    """
+
+    def __init__(self, client):
+        self.r = client
+        self._unregister = client.register_script(UNREGISTER_SCRIPT)
+        self._finish = client.register_script(FINISH_SCRIPT)
+        self._expire = client.register_script(EXPIRE_SCRIPT)
+
+    # Hosts
+
+    async def register_host(self, host_id, sid):
+        await self.r.hset(HOSTS_KEY, host_id, sid)
+
+    async def unregister_host(self, host_id, sid):
+        return await self._unregister(keys=[HOSTS_KEY], args=[host_id, sid]) == 1
+
+    async def host_sid(self, host_id):
+        return await self.r.hget(HOSTS_KEY, host_id)
+
+    # Assignments
+
+    async def assign(self, sha256, host_id, timeout):
+        pipe = self.r.pipeline()
+        pipe.hset(ASSIGNMENTS_KEY, sha256, host_id)
+        pipe.zadd(DEADLINES_KEY, {sha256: time.time() + timeout})
+        pipe.hset(DISPATCHED_KEY, sha256, time.time())
+        await pipe.execute()
+
+    async def owner(self, sha256):
+        return await self.r.hget(ASSIGNMENTS_KEY, sha256)
+
+    async def renew(self, sha256, timeout):
+        """Push back a deadline; does nothing if the assignment is gone."""
+        await self.r.zadd(DEADLINES_KEY, {sha256: time.time() + timeout}, xx=True)
+
+    async def finish(self, sha256, host_id):
+        """
+        End an assignment held by host_id. Returns the unix time it was
+        dispatched, or None if host_id did not hold it.
+        """
+        if host_id is None:
+            return None
+        dispatched = await self._finish(keys=[ASSIGNMENTS_KEY, DEADLINES_KEY, DISPATCHED_KEY],
+                                        args=[sha256, host_id])
+        return float(dispatched) if dispatched is not None else None
+
+    async def expire(self):
+        """Take the assignments past their deadline as (sha256, host_id)."""
+        taken = await self._expire(keys=[ASSIGNMENTS_KEY, DEADLINES_KEY, DISPATCHED_KEY],
+                                   args=[time.time()])
+        return list(zip(taken[0::2], taken[1::2]))
+
+    async def by_host(self):
+        """host id → list of sha256 it is analyzing."""
+        hosts = {}
+        for sha256, host_id in (await self.r.hgetall(ASSIGNMENTS_KEY)).items():
+            hosts.setdefault(host_id, []).append(sha256)
+        return hosts
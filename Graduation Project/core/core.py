@@ -1,141 +1,555 @@
 import asyncio
+import os
+import socket
+import time
 from datetime import datetime
 import aiohttp
-import requests
+import redis
+import redis.asyncio as aioredis
 import socketio
 import uvicorn
+from prometheus_client import make_asgi_app
+from assignments import AssignmentTable
+import metrics
+
+# Data access publishes on this channel whenever a sample becomes claimable
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+NEW_SAMPLES_CHANNEL = "samples:new"
+
+# Multi-instance mode: cores relay Socket.IO emits to each other through
+# Redis, so any core can reach any host (e.g. redis://localhost:6379/0)
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
 
 # Socket.IO server
-sio = socketio.AsyncServer(async_mode="asgi")
-app = socketio.ASGIApp(sio)
+sio = socketio.AsyncServer(
+    async_mode="asgi",
+    client_manager=socketio.AsyncRedisManager(SOCKETIO_MESSAGE_QUEUE)
+    if SOCKETIO_MESSAGE_QUEUE else None)
+# Prometheus metrics are served on /metrics, everything else is Socket.IO
+app = socketio.ASGIApp(sio, other_asgi_app=make_asgi_app())
+
+CORE_PORT = int(os.getenv("CORE_PORT", "5002"))
 
 # Data Access URLs
 DATA_ACCESS_URL = "http://localhost:5001/"
-GET_UNANALIZED_SAMPLE_URL = "http://localhost:5001/samples/unanalyzed/first"
+CLAIM_SAMPLES_URL = "http://localhost:5001/samples/claim"
+
+# Identifies this core instance in the presence registry
+WORKER_ID = f"core-{socket.gethostname()}-{os.getpid()}"
+# Leases are held in the name of the whole core cluster, so any core can
+# renew, complete or release a sample claimed by another one
+LEASE_OWNER = os.getenv("CORE_CLUSTER_ID", "core")
+# How long a claimed sample is held before it goes back in the queue
+LEASE_SECONDS = 600
+
+# A host gets this long to report progress on an assignment before the
+# sample is taken back: the detonation itself plus transfer, static
+# analysis and report upload. Every progress event restarts the clock.
+DETONATION_SECONDS = int(os.getenv("DETONATION_SECONDS", "12"))
+ANALYSIS_OVERHEAD_SECONDS = int(os.getenv("ANALYSIS_OVERHEAD_SECONDS", "180"))
+ASSIGNMENT_TIMEOUT = DETONATION_SECONDS + ANALYSIS_OVERHEAD_SECONDS
+# How often expired assignments are looked for
+REAPER_INTERVAL = 5
+# A disconnected host has this long to reconnect (to any core) and carry on
+RECONNECT_GRACE = 30
+# Stages a host reports through stage_update
+STAGES = ("static", "dynamic", "network")
+# Why a sample went back to the queue, the reason label of
+# core_samples_requeued_total; the host's error text is only logged
+REQUEUE_REASONS = ("expired", "failed", "cancelled", "released")
+# Phases of the timing breakdown a host sends with file_processed
+HOST_PHASES = ("upload", "vm", "report_fetch", "report_upload", "reports", "report_wait", "total")
+
+# Presence heartbeat: sent every interval, record expires after ttl
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TTL = 15
+
+# Safety-net poll in case a notification is missed
+RECONCILE_INTERVAL = 30
+
+# Outbound HTTP: one pooled keep-alive session shared by every task
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=5)
+HTTP_POOL_SIZE = 20
+HTTP_KEEPALIVE = 30
+
+# Event loop stalls longer than this are reported
+LOOP_LAG_INTERVAL = 0.5
+LOOP_LAG_THRESHOLD = 0.1
+
+# How often the queue depth is read from data access for /metrics
+QUEUE_STATS_URL = "http://localhost:5001/queue/stats"
+QUEUE_STATS_INTERVAL = 15
 
 # Global state
-current_sample = None
+http_session = None
+# Assignments shared by all cores, see assignments.py
+assignments = None
 sample_fetcher_task = None
+# Strong references to the other background tasks; asyncio only keeps weak ones
+background_tasks = []
 connected_clients = set()
+# Hosts connected to this core: sid → {"host_id", "slots"}
+hosts = {}
+# Set when there may be work to dispatch (notification, free host, new host)
+sample_available = asyncio.Event()
+
+
+async def free_slots():
+    """Free analysis slots of this core's hosts, most idle host first."""
+    busy = await assignments.by_host()
+    free = [(sid, host["slots"] - len(busy.get(host["host_id"], [])))
+            for sid, host in hosts.items()]
+    return sorted(((sid, n) for sid, n in free if n > 0),
+                  key=lambda item: -item[1])
+
+
+async def local_samples():
+    """Samples being analyzed by hosts connected to this core."""
+    busy = await assignments.by_host()
+    return [sha256 for host in hosts.values()
+            for sha256 in busy.get(host["host_id"], [])]
+
+
+def host_of(sid):
+    host = hosts.get(sid)
+    return host["host_id"] if host else None
+
+
+def create_http_session():
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_SIZE, keepalive_timeout=HTTP_KEEPALIVE)
+    return aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+
+
+async def release_lease(sha256, reason="released", error=None):
+    """
+    Give a sample back to the queue so it can be claimed again. `reason`
+    is one of REQUEUE_REASONS. An `error` counts the attempt as failed,
+    which eventually quarantines the sample.
+    """
+    params = {"worker": LEASE_OWNER}
+    if error:
+        params.update(failed="true", error=error)
+    metrics.SAMPLES_REQUEUED.labels(reason=reason).inc()
+    try:
+        async with http_session.delete(
+            f"{DATA_ACCESS_URL}samples/{sha256}/lease",
+            params=params
+        ) as response:
+            print(f"Released {sha256} ({reason}"
+                  + (f": {error}" if error else "") + f"): {response.status}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error releasing {sha256}: {e}")
 
 
 @sio.event
 async def connect(sid, environ):
-    global sample_fetcher_task
-
     print(f"Client connected: {sid}")
     connected_clients.add(sid)
+    # One slot, identified by its sid, until the host registers
+    hosts[sid] = {"host_id": sid, "slots": 1}
+    await assignments.register_host(sid, sid)
+    sample_available.set()
+
+
+@sio.event
+async def register(sid, data):
+    """
+    A host announces its id and how many samples it can analyze at once.
+    A host that reconnects with a known id picks up its assignments.
+    """
+    if sid not in hosts or not isinstance(data, dict):
+        return
+    host_id = str(data.get("host_id") or sid)
+    await assignments.unregister_host(hosts[sid]["host_id"], sid)
+    hosts[sid] = {"host_id": host_id, "slots": max(int(data.get("slots", 1)), 0)}
+    await assignments.register_host(host_id, sid)
+
+    # The host is back: its samples get a full deadline again
+    resumed = (await assignments.by_host()).get(host_id, [])
+    for sha256 in resumed:
+        await assignments.renew(sha256, ASSIGNMENT_TIMEOUT)
+
+    print(f"Host {host_id} ({sid}) registered with {hosts[sid]['slots']} slot(s)"
+          + (f", resuming {len(resumed)} sample(s)" if resumed else ""))
+    sample_available.set()
+
+
+@sio.event
+async def capacity(sid, data):
+    """
+    A registered host can now take a different number of samples at once
+    (a VM booted, is being recycled or faulted); 0 takes none. Its
+    assignments are left alone: a hung sample keeps its deadline.
+    """
+    if sid not in hosts or not isinstance(data, dict):
+        return
+    hosts[sid]["slots"] = max(int(data.get("slots", 1)), 0)
+    print(f"Host {hosts[sid]['host_id']} ({sid}) now has {hosts[sid]['slots']} slot(s)")
+    sample_available.set()
 
 
 @sio.event
 async def disconnect(sid):
     print(f"Client disconnected: {sid}")
     connected_clients.discard(sid)
-    # Do NOT cancel the background task
+    host = hosts.pop(sid, None)
+    if host is None:
+        return
+
+    # Keep the host's samples for a short while in case it reconnects;
+    # the reaper hands them back to the queue otherwise
+    if await assignments.unregister_host(host["host_id"], sid):
+        for sha256 in (await assignments.by_host()).get(host["host_id"], []):
+            await assignments.renew(sha256, RECONNECT_GRACE)
 
 
 @sio.event
 async def file_processed(sid, data):
-    global current_sample
-
     print(f"Received from {sid}: {data}")
 
-    if not current_sample:
+    sha256 = data.get("sha256") if isinstance(data, dict) else data
+    dispatched = await assignments.finish(sha256, host_of(sid))
+    if dispatched is None:
+        print(f"Ignoring {sha256}: not assigned to {sid}")
         return
 
+    metrics.SAMPLES_PROCESSED.labels(host=host_of(sid)).inc()
+    if dispatched:
+        metrics.DISPATCH_TO_PROCESSED.observe(max(time.time() - dispatched, 0))
+    # Timing breakdown measured by the host
+    timings = data.get("timings") if isinstance(data, dict) else None
+    for phase, seconds in (timings or {}).items():
+        if phase in HOST_PHASES and isinstance(seconds, (int, float)):
+            metrics.HOST_PHASE.labels(phase=phase).observe(seconds)
+
     payload = {
         "static_analysis": True,
         "dynamic_analysis": True
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            DATA_ACCESS_URL + "samples/" +
-                current_sample["hash_sha256"] + "/analysis",
+    try:
+        async with http_session.post(
+            DATA_ACCESS_URL + "samples/" + sha256 + "/analysis",
             json=payload
         ) as response:
 
             if response.status == 200:
-                print("Sample marked for analysis:",
-                      current_sample["hash_sha256"])
-                current_sample = None
+                print("Sample marked for analysis:", sha256)
             else:
                 print("Error marking sample for analysis")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error marking sample for analysis: {e}")
 
+    # The slot is free either way; an unrecorded sample comes back when its lease runs out
+    sample_available.set()
 
-async def sample_fetcher():
-    global current_sample
 
-    print("Sample fetcher started")
+@sio.event
+async def file_failed(sid, data):
+    """The host could not analyze a sample: put it back in the queue."""
+    print(f"Analysis failed on {sid}: {data}")
+
+    sha256 = data.get("sha256") if isinstance(data, dict) else data
+    if await assignments.finish(sha256, host_of(sid)) is None:
+        return
+
+    error = data.get("error") if isinstance(data, dict) else None
+    await release_lease(sha256, "failed", error or "analysis failed on host")
+    sample_available.set()
+
+
+@sio.event
+async def analysis_progress(sid, data):
+    """A host reports progress on a sample: renew its assignment and lease."""
+    if not isinstance(data, dict):
+        return
+    sha256 = data.get("sha256")
+    if await assignments.owner(sha256) != host_of(sid):
+        return
+
+    await assignments.renew(sha256, ASSIGNMENT_TIMEOUT)
+    print(f"Progress on {sha256} from {sid}: {data.get('stage')}")
 
     try:
-        async with aiohttp.ClientSession() as session:
-            while True:
+        async with http_session.post(
+            f"{DATA_ACCESS_URL}samples/{sha256}/lease",
+            json={"worker": LEASE_OWNER, "lease_seconds": LEASE_SECONDS}
+        ) as response:
+            if response.status != 200:
+                print(f"Could not renew the lease on {sha256}: {response.status}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error renewing the lease on {sha256}: {e}")
 
-                # No clients connected → idle
-                if not connected_clients:
-                    await asyncio.sleep(1)
-                    continue
 
-                if current_sample is None:
-                    # print current time for debugging
-                    print(datetime.now().strftime("%H:%M:%S") +
-                          " - Fetching unanalyzed sample...")
-
-                    async with session.get(GET_UNANALIZED_SAMPLE_URL) as response:
-                        if response.status == 404:
-                            print(datetime.now().strftime("%H:%M:%S") +
-                                  " - No unanalyzed samples available")
-                            pass
-                        elif response.status == 200:
-                            print(datetime.now().strftime("%H:%M:%S") +
-                                  " - Unanalyzed sample fetched !!!")
-                            current_sample = await response.json()
-                            await sio.emit(
-                                "file_sha256",
-                                current_sample["hash_sha256"]
-                            )
+@sio.event
+async def stage_update(sid, data):
+    """
+    A host reports that a stage (static, dynamic, network) of a sample is
+    running, done or failed: record it right away so finished stages are
+    visible before the whole analysis ends.
+    """
+    if not isinstance(data, dict) or data.get("stage") not in STAGES:
+        return
+    sha256 = data.get("sha256")
+    if await assignments.owner(sha256) != host_of(sid):
+        return
+
+    # A transition is progress too
+    await analysis_progress(sid, data)
+
+    try:
+        async with http_session.post(
+            f"{DATA_ACCESS_URL}samples/{sha256}/analysis",
+            json={f"{data['stage']}_status": data.get("status")}
+        ) as response:
+            if response.status != 200:
+                print(f"Could not record {data['stage']} {data.get('status')} "
+                      f"for {sha256}: {response.status}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error recording the stage status of {sha256}: {e}")
+
+
+async def lease_reaper():
+    """
+    Take back samples whose host stopped reporting progress or did not
+    reconnect in time. Every core runs this; each expired assignment is
+    taken by exactly one of them.
+    """
+    while True:
+        await asyncio.sleep(REAPER_INTERVAL)
+        try:
+            expired = await assignments.expire()
+        except redis.RedisError as e:
+            print(f"Reaper error: {e}")
+            continue
+
+        for sha256, host_id in expired:
+            sid = await assignments.host_sid(host_id)
+            print(datetime.now().strftime("%H:%M:%S") +
+                  f" - Assignment of {sha256} to {host_id} expired, requeueing")
+            if sid is None:
+                await release_lease(sha256, "expired", "host disconnected")
+            else:
+                # Reaches the host through whichever core it is connected to
+                await sio.emit("cancel_analysis", sha256, to=sid)
+                await release_lease(sha256, "cancelled", "assignment expired")
 
+        if expired:
+            sample_available.set()
+
+
+async def sample_listener():
+    """Wake the fetcher as soon as data access announces a new sample."""
+    # One client for every retry; the pubsub connection is its only user
+    client = aioredis.from_url(REDIS_URL)
+    try:
+        while True:
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(NEW_SAMPLES_CHANNEL)
+                    print("Subscribed to new sample notifications")
+                    # Catch up on anything published while we were not listening
+                    sample_available.set()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            sample_available.set()
+            except (redis.RedisError, OSError) as e:
+                print(f"Sample listener error: {e}, retrying in 5s")
                 await asyncio.sleep(5)
+    finally:
+        await client.aclose()
+
+
+async def claim_samples(count):
+    claim = {"worker": LEASE_OWNER, "count": count,
+             "lease_seconds": LEASE_SECONDS}
+    try:
+        async with http_session.post(CLAIM_SAMPLES_URL, json=claim) as response:
+            return await response.json() if response.status == 200 else []
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error claiming samples: {e}")
+        return []
+
+
+def record_dispatch(sample, host_id):
+    metrics.SAMPLES_DISPATCHED.labels(host=host_id).inc()
+    try:
+        uploaded = datetime.fromisoformat(sample["upload_date"])
+    except (KeyError, TypeError, ValueError):
+        return
+    metrics.UPLOAD_TO_DISPATCH.observe(
+        max((datetime.now() - uploaded).total_seconds(), 0))
+
+
+async def sample_fetcher():
+    print("Sample fetcher started")
+
+    try:
+        while True:
+            sample_available.clear()
+
+            try:
+                free = await free_slots()
+                if free:
+                    # print current time for debugging
+                    print(datetime.now().strftime("%H:%M:%S") +
+                          " - Fetching unanalyzed samples...")
+
+                    claimed = await claim_samples(min(sum(n for _, n in free), 100))
+                    if not claimed:
+                        print(datetime.now().strftime("%H:%M:%S") +
+                              " - No unanalyzed samples available")
+
+                    # Spread the samples over the hosts, one free slot at a time
+                    slots = [sid for sid, n in free for _ in range(n)]
+                    for sid, sample in zip(slots, claimed):
+                        sha256 = sample["hash_sha256"]
+                        if sid not in hosts:
+                            # Host left while we were claiming
+                            await release_lease(sha256)
+                            continue
+                        await assignments.assign(sha256, hosts[sid]["host_id"], ASSIGNMENT_TIMEOUT)
+                        print(datetime.now().strftime("%H:%M:%S") +
+                              f" - Sample {sha256} assigned to {sid}")
+                        await sio.emit("file_sha256", sha256, to=sid)
+                        record_dispatch(sample, hosts[sid]["host_id"])
+            except redis.RedisError as e:
+                print(f"Sample fetcher error: {e}")
+
+            # Sleep until notified, reconciling with a slow poll
+            try:
+                await asyncio.wait_for(sample_available.wait(), RECONCILE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
 
     except asyncio.CancelledError:
         print("Sample fetcher cancelled")
         raise
 
 
-# Hearbeat task
+# Hearbeat task: refresh this core's presence record in data access
 async def heartbeat():
     while True:
-        data = {
-            "clients": list(connected_clients)
-        }
-
         try:
-            response = requests.post(
-                DATA_ACCESS_URL + "update_core/", json=data)
-            print(f"Heartbeat sent")
-        except requests.RequestException as e:
+            current_samples = await local_samples()
+            data = {
+                "role": "core",
+                "capacity": sum(host["slots"] for host in hosts.values()),
+                "busy": len(current_samples),
+                "current_samples": current_samples,
+                "clients": list(connected_clients),
+                "ttl": HEARTBEAT_TTL,
+            }
+
+            metrics.HOSTS_CONNECTED.set(len(hosts))
+            metrics.SLOTS.labels(state="busy").set(data["busy"])
+            metrics.SLOTS.labels(state="free").set(max(data["capacity"] - data["busy"], 0))
+
+            async with http_session.post(
+                f"{DATA_ACCESS_URL}workers/{WORKER_ID}/heartbeat", json=data
+            ) as response:
+                print(f"Heartbeat sent: {response.status}")
+                if response.status != 200:
+                    metrics.HEARTBEAT_FAILURES.inc()
+        except (aiohttp.ClientError, asyncio.TimeoutError, redis.RedisError) as e:
             print(f"Error sending heartbeat: {e}")
+            metrics.HEARTBEAT_FAILURES.inc()
+
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
 
-        await asyncio.sleep(5)
+
+async def leave_fleet():
+    """Drop this core's presence record now rather than when its TTL runs out."""
+    for task in background_tasks:
+        task.cancel()
+    try:
+        async with http_session.delete(f"{DATA_ACCESS_URL}workers/{WORKER_ID}") as response:
+            print(f"Left the fleet: {response.status}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error leaving the fleet: {e}")
+
+
+async def loop_lag_monitor():
+    """Report event loop stalls, i.e. something blocking inside a coroutine."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = loop.time() - started - LOOP_LAG_INTERVAL
+        metrics.LOOP_LAG.observe(max(lag, 0))
+        if lag > LOOP_LAG_THRESHOLD:
+            print(datetime.now().strftime("%H:%M:%S") +
+                  f" - Event loop stalled for {lag * 1000:.0f} ms")
+
+
+async def queue_monitor():
+    """Publish the pending queue depth per lane as metrics."""
+    while True:
+        try:
+            async with http_session.get(QUEUE_STATS_URL) as response:
+                stats = await response.json() if response.status == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error reading queue stats: {e}")
+            stats = None
+
+        if stats:
+            depth, oldest = {}, {}
+            for entry in stats["classes"]:
+                lane = entry["lane"]
+                depth[lane] = depth.get(lane, 0) + entry["waiting"]
+                oldest[lane] = max(oldest.get(lane, 0), entry["oldest_wait"] or 0)
+            # Drop lanes that no longer have pending samples
+            metrics.QUEUE_DEPTH.clear()
+            metrics.QUEUE_OLDEST_WAIT.clear()
+            for lane in depth:
+                metrics.QUEUE_DEPTH.labels(lane=lane).set(depth[lane])
+                metrics.QUEUE_OLDEST_WAIT.labels(lane=lane).set(oldest[lane])
+
+        await asyncio.sleep(QUEUE_STATS_INTERVAL)
 
 
 if __name__ == "__main__":
     async def main():
+        global sample_fetcher_task, http_session, assignments
+
+        http_session = create_http_session()
+        assignments = AssignmentTable(
+            aioredis.from_url(REDIS_URL, decode_responses=True))
+
+        # Report blocking calls on the event loop
+        background_tasks.append(asyncio.create_task(loop_lag_monitor()))
+
         # Start the heartbeat as a background task
-        asyncio.create_task(heartbeat())
+        background_tasks.append(asyncio.create_task(heartbeat()))
+
+        # Listen for new sample notifications
+        background_tasks.append(asyncio.create_task(sample_listener()))
+
+        # Requeue samples whose host went quiet
+        background_tasks.append(asyncio.create_task(lease_reaper()))
+
+        # Queue depth for /metrics
+        background_tasks.append(asyncio.create_task(queue_monitor()))
 
         # Start background task once
         if sample_fetcher_task is None:
             sample_fetcher_task = asyncio.create_task(sample_fetcher())
 
-        print("Starting Socket.IO server on port 5002...")
+        print(f"Starting Socket.IO server on port {CORE_PORT}...")
+
+        # Runs on uvicorn's lifespan shutdown, before the signal that
+        # stopped the server cancels this coroutine
+        app.on_shutdown = leave_fleet
 
         # Start the Socket.IO ASGI app with Uvicorn
         config = uvicorn.Config(app, host="0.0.0.0",
-                                port=5002, log_level="info")
+                                port=CORE_PORT, log_level="info")
         server = uvicorn.Server(config)
-        await server.serve()
+        try:
+            await server.serve()
+        finally:
+            await http_session.close()
 
     # Run the async main function
     asyncio.run(main())
@@ -0,0 +1,47 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics of the core, served on /metrics next to Socket.IO.
+# Latencies are histograms so fleet sizing can use real p50/p95/p99.
+
+QUEUE_DEPTH = Gauge(
+    "core_queue_depth", "Samples waiting to be claimed, per lane", ["lane"])
+
+QUEUE_OLDEST_WAIT = Gauge(
+    "core_queue_oldest_wait_seconds", "Age of the oldest waiting sample, per lane", ["lane"])
+
+UPLOAD_TO_DISPATCH = Histogram(
+    "core_upload_to_dispatch_seconds", "Time from upload until a host is given the sample",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900,
+             1800, 3600, 7200, 14400, 43200, 86400))
+
+DISPATCH_TO_PROCESSED = Histogram(
+    "core_dispatch_to_processed_seconds", "Time from dispatch until the host reports file_processed",
+    buckets=(5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600, 900, 1800))
+
+HOST_PHASE = Histogram(
+    "core_host_phase_seconds", "Where a host spent a sample's turnaround, per phase "
+    "(upload, vm, report_fetch, report_upload, reports, report_wait, total)", ["phase"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+
+SAMPLES_DISPATCHED = Counter(
+    "core_samples_dispatched_total", "Samples sent to a host", ["host"])
+
+SAMPLES_PROCESSED = Counter(
+    "core_samples_processed_total", "Samples a host finished (rate() * 3600 = per hour)", ["host"])
+
+SAMPLES_REQUEUED = Counter(
+    "core_samples_requeued_total", "Samples given back to the queue "
+    "(expired, failed, cancelled, released)", ["reason"])
+
+HOSTS_CONNECTED = Gauge(
+    "core_hosts_connected", "Hosts connected to this core")
+
+SLOTS = Gauge(
+    "core_analysis_slots", "Analysis slots of the hosts connected to this core", ["state"])
+
+HEARTBEAT_FAILURES = Counter(
+    "core_heartbeat_failures_total", "Presence heartbeats that did not reach data access")
+
+LOOP_LAG = Histogram(
+    "core_event_loop_lag_seconds", "How late the event loop woke up from a timed sleep",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import time
+
+import redis
+from fastapi.encoders import jsonable_encoder
+
+STATS_KEY = "cache:stats"
+LIST_GENERATION_KEY = "cache:samples:gen"
+LIST_PAGES_KEY = "cache:samples:pages"
+
+
+class SampleCache:
+    """
+    Read-through Redis cache for sample metadata and listing pages.
+
+    A sample is cached under both its id and its sha256 and is deleted when
+    its row changes; it is only written back if no write happened since it
+    was read from the DB (same generation). Listing pages are keyed by a generation number that is
+    bumped on every sample write, so stale pages are never served and simply
+    expire. Every entry has a TTL, entries larger than max_entry_bytes are
+    not cached, and at most max_pages listing pages are kept.
+
+    Redis errors are treated as cache misses.
+    """
+
+    def __init__(self, client, ttl=300, max_entry_bytes=64 * 1024, max_pages=1000):
+        self.r = client
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.max_pages = max_pages
+
+    @staticmethod
+    def _sample_keys(sample_id, hash_sha256):
+        keys = [f"cache:sample:id:{sample_id}"]
+        if hash_sha256:
+            keys.append(f"cache:sample:sha256:{hash_sha256}")
+        return keys
+
+    def _count(self, field):
+        try:
+            self.r.hincrby(STATS_KEY, field, 1)
+        except redis.RedisError:
+            pass
+
+    def _load(self, key, kind):
+        try:
+            cached = self.r.get(key)
+        except redis.RedisError as e:
+            print(f"Cache unavailable: {e}")
+            cached = None
+        self._count(f"{kind}_hits" if cached is not None else f"{kind}_misses")
+        return json.loads(cached) if cached is not None else None
+
+    def _encode(self, value):
+        payload = json.dumps(jsonable_encoder(value))
+        return payload if len(payload) <= self.max_entry_bytes else None
+
+    # Single samples
+
+    def get_sample(self, identifier):
+        """Look up a sample by id ("42") or sha256."""
+        kind = "sha256" if len(identifier) == 64 else "id"
+        return self._load(f"cache:sample:{kind}:{identifier}", "sample")
+
+    def generation(self):
+        """
+        Current write generation, or None if Redis is unavailable. Take it
+        before reading a sample from the DB and pass it to set_sample().
+        """
+        try:
+            return self.r.get(LIST_GENERATION_KEY) or "0"
+        except redis.RedisError:
+            return None
+
+    def set_sample(self, sample, generation):
+        """Cache a sample read under `generation`, unless a write came in since."""
+        payload = self._encode(sample)
+        if payload is None or generation is None:
+            return
+        try:
+            with self.r.pipeline() as pipe:
+                pipe.watch(LIST_GENERATION_KEY)
+                if (pipe.get(LIST_GENERATION_KEY) or "0") != generation:
+                    return
+                pipe.multi()
+                for key in self._sample_keys(sample["id"], sample.get("hash_sha256")):
+                    pipe.setex(key, self.ttl, payload)
+                pipe.execute()
+        except redis.WatchError:
+            pass  # Invalidated while we were writing: the row may be stale
+        except redis.RedisError as e:
+            print(f"Cache unavailable: {e}")
+
+    def invalidate_sample(self, sample_id, hash_sha256):
+        """Drop a sample's entries and every cached listing page."""
+        try:
+            pipe = self.r.pipeline()
+            pipe.delete(*self._sample_keys(sample_id, hash_sha256))
+            pipe.incr(LIST_GENERATION_KEY)
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"Cache unavailable: {e}")
+
+    def invalidate_listings(self):
+        try:
+            self.r.incr(LIST_GENERATION_KEY)
+        except redis.RedisError as e:
+            print(f"Cache unavailable: {e}")
+
+    # Listing pages
+
+    def page_key(self, params):
+        """
+        Key of a listing page under the current generation. Take it before
+        querying the DB so a write that lands meanwhile makes the result
+        unreachable instead of stale.
+        """
+        try:
+            generation = self.r.get(LIST_GENERATION_KEY) or 0
+        except redis.RedisError:
+            return None
+        digest = hashlib.sha1(json.dumps(
+            jsonable_encoder(params), sort_keys=True).encode()).hexdigest()
+        return f"cache:samples:{generation}:{digest}"
+
+    def get_page(self, key):
+        if key is None:
+            self._count("page_misses")
+            return None
+        return self._load(key, "page")
+
+    def set_page(self, key, page):
+        payload = self._encode(page)
+        if key is None or payload is None:
+            return
+        try:
+            pipe = self.r.pipeline()
+            pipe.setex(key, self.ttl, payload)
+            pipe.zadd(LIST_PAGES_KEY, {key: time.time()})
+            pipe.zcard(LIST_PAGES_KEY)
+            count = pipe.execute()[-1]
+
+            # Evict the oldest pages beyond the bound
+            if count > self.max_pages:
+                evicted = self.r.zpopmin(LIST_PAGES_KEY, count - self.max_pages)
+                if evicted:
+                    self.r.delete(*[k for k, _ in evicted])
+        except redis.RedisError as e:
+            print(f"Cache unavailable: {e}")
+
+    def stats(self):
+        try:
+            counters = {k: int(v) for k, v in self.r.hgetall(STATS_KEY).items()}
+            pages = self.r.zcard(LIST_PAGES_KEY)
+        except redis.RedisError as e:
+            return {"status": "failed", "error": str(e)}
+
+        stats = {"status": "success", "cached_pages": pages,
+                 "ttl": self.ttl, "max_pages": self.max_pages}
+        for kind in ("sample", "page"):
+            hits = counters.get(f"{kind}_hits", 0)
+            misses = counters.get(f"{kind}_misses", 0)
+            stats[kind] = {"hits": hits, "misses": misses,
+                           "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None}
+        return stats
@@ -0,0 +1,346 @@
+import base64
+import json
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, update, func, insert, case
+from sqlalchemy.exc import IntegrityError
+
+from models import Sample, Finding, Ioc, Verdict
+from scheduling import POLICIES, DEFAULT_POLICY, LANES
+
+# Columns a caller may ask for through ?fields=
+SAMPLE_FIELDS = [c.name for c in Sample.__table__.columns]
+
+# Values accepted by ?status=
+ANALYSIS_STATUSES = ("pending", "analyzed", "quarantined")
+
+MAX_PAGE_SIZE = 500
+
+# Analysis stages reported by the VM, and the states each one goes through
+STAGES = ("static", "dynamic", "network")
+STAGE_STATUSES = ("queued", "running", "done", "failed")
+FINAL_STAGE_STATUSES = ("done", "failed")
+
+# Claims a sample may use up before it is quarantined
+MAX_ATTEMPTS = int(os.getenv("MAX_ANALYSIS_ATTEMPTS", "3"))
+
+# Times claim_samples() goes back for more candidates after losing some of
+# them to concurrent claimers
+CLAIM_ROUNDS = 5
+
+
+def encode_cursor(upload_date, sample_id):
+    raw = json.dumps([upload_date.isoformat(), sample_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    upload_date, sample_id = json.loads(base64.urlsafe_b64decode(cursor))
+    return datetime.fromisoformat(upload_date), int(sample_id)
+
+
+def list_samples(db, limit=10, cursor=None, status=None, file_type=None,
+                 date_from=None, date_to=None, fields=None):
+    """
+    Return one page of samples ordered by (upload_date, id), newest first,
+    and the cursor of the next page (None on the last page).
+
+    Pagination is keyset based, so every page costs the same index range
+    scan no matter how deep into the table it is.
+    """
+    fields = list(fields or SAMPLE_FIELDS)
+    # The cursor is built from these two, so they are always selected
+    selected = fields + [f for f in ("upload_date", "id") if f not in fields]
+
+    query = db.query(*[getattr(Sample, f) for f in selected])
+
+    if status == "pending":
+        query = query.filter(Sample.analysis_pending == True,
+                             Sample.quarantined == False)
+    elif status == "analyzed":
+        query = query.filter(Sample.analysis_pending == False)
+    elif status == "quarantined":
+        query = query.filter(Sample.quarantined == True)
+    if file_type:
+        query = query.filter(Sample.file_type == file_type)
+    if date_from:
+        query = query.filter(Sample.upload_date >= date_from)
+    if date_to:
+        query = query.filter(Sample.upload_date < date_to)
+    if cursor:
+        # Spelled out rather than a row comparison, which MariaDB does not
+        # reliably turn into a range scan on (upload_date, id). The leading
+        # <= is what the index seeks on; the OR alone is a full index scan.
+        upload_date, sample_id = decode_cursor(cursor)
+        query = query.filter(
+            Sample.upload_date <= upload_date,
+            or_(Sample.upload_date < upload_date,
+                and_(Sample.upload_date == upload_date, Sample.id < sample_id)))
+
+    # Fetch one extra row to know whether there is a next page
+    rows = query.order_by(Sample.upload_date.desc(), Sample.id.desc()) \
+        .limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].upload_date, rows[-1].id)
+
+    return [{f: getattr(row, f) for f in fields} for row in rows], next_cursor
+
+
+def claimable():
+    """Filter for pending samples whose lease is free or has expired."""
+    return and_(Sample.analysis_pending == True,
+                Sample.quarantined == False,
+                or_(Sample.lease_expires.is_(None),
+                    Sample.lease_expires < datetime.now()))
+
+
+def claim_samples(db, worker, count=1, lease_seconds=600, policy=DEFAULT_POLICY, lane=None):
+    """
+    Atomically claim up to `count` pending samples for `worker`, in the
+    order chosen by the scheduling `policy` (see scheduling.POLICIES).
+
+    Candidates are picked without holding locks on the rows that are not
+    chosen (fifo reads them FOR UPDATE SKIP LOCKED), and each one is taken
+    with a conditional UPDATE, so a sample is never handed to two workers
+    even on backends that ignore row locks (SQLite).
+
+    Every core is woken by the same notification and computes the same
+    best candidates, so most of them lose those UPDATEs; a claimer that
+    lost some goes back for the next best ones, up to CLAIM_ROUNDS times.
+    """
+    now = datetime.now()
+    lease_expires = now + timedelta(seconds=lease_seconds)
+    claimed_ids = []
+    tried = set()
+    for _ in range(CLAIM_ROUNDS):
+        wanted = count - len(claimed_ids)
+        candidates = POLICIES[policy](
+            db, and_(claimable(), Sample.id.notin_(tried)) if tried else claimable(),
+            wanted, lane)
+        for sample_id in candidates:
+            tried.add(sample_id)
+            result = db.execute(
+                update(Sample)
+                .where(Sample.id == sample_id, claimable())
+                .values(claimed_by=worker, lease_expires=lease_expires, claimed_at=now,
+                        attempts=Sample.attempts + 1)
+            )
+            if result.rowcount == 1:
+                claimed_ids.append(sample_id)
+        # Done, or nothing left to try
+        if len(claimed_ids) == count or len(candidates) < wanted:
+            break
+    db.commit()
+
+    if not claimed_ids:
+        return []
+    samples = {sample.id: sample for sample in
+               db.query(Sample).filter(Sample.id.in_(claimed_ids)).all()}
+    return [samples[sample_id] for sample_id in claimed_ids]
+
+
+def extend_lease(db, hash_sha256, worker, lease_seconds=600):
+    """Push the lease deadline of a sample held by `worker`. Returns True on success."""
+    result = db.execute(
+        update(Sample)
+        .where(Sample.hash_sha256 == hash_sha256,
+               Sample.claimed_by == worker,
+               Sample.analysis_pending == True)
+        .values(lease_expires=datetime.now() + timedelta(seconds=lease_seconds))
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def stage_statuses(sample):
+    """stage → status of one sample, e.g. {"static": "done", ...}."""
+    return {stage: getattr(sample, f"{stage}_status") for stage in STAGES}
+
+
+def release_lease(db, hash_sha256, worker, failed=False, error=None):
+    """
+    Give a sample held by `worker` back to the queue. Returns True on success.
+
+    A plain release hands the attempt back. A failed one keeps it and
+    records `error`; once MAX_ATTEMPTS are used up the sample is quarantined.
+    """
+    values = {"claimed_by": None, "lease_expires": None}
+    if failed:
+        values["last_error"] = (error or "analysis failed")[:255]
+        values["quarantined"] = Sample.attempts >= MAX_ATTEMPTS
+    else:
+        values["attempts"] = case((Sample.attempts > 0, Sample.attempts - 1), else_=0)
+    result = db.execute(
+        update(Sample)
+        .where(Sample.hash_sha256 == hash_sha256, Sample.claimed_by == worker)
+        .values(**values)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def quarantine_expired(db):
+    """
+    Quarantine samples whose last allowed attempt ran out of lease without
+    a result, i.e. whose worker vanished while holding them.
+
+    Returns (id, sha256) of the quarantined samples, so their cache
+    entries can be dropped.
+    """
+    expired = and_(Sample.analysis_pending == True,
+                   Sample.quarantined == False,
+                   Sample.lease_expires < datetime.now(),
+                   Sample.attempts >= MAX_ATTEMPTS)
+    samples = db.query(Sample.id, Sample.hash_sha256).filter(expired).all()
+    if not samples:
+        return []
+    db.execute(
+        update(Sample)
+        .where(Sample.id.in_([sample_id for sample_id, _ in samples]), expired)
+        .values(quarantined=True, claimed_by=None, lease_expires=None,
+                last_error="lease expired")
+    )
+    db.commit()
+    return [(sample_id, hash_sha256) for sample_id, hash_sha256 in samples]
+
+
+def requeue_sample(db, hash_sha256):
+    """Put a sample back in the queue with a fresh set of attempts."""
+    result = db.execute(
+        update(Sample)
+        .where(Sample.hash_sha256 == hash_sha256, Sample.analysis_pending == True)
+        .values(quarantined=False, attempts=0, last_error=None,
+                claimed_by=None, lease_expires=None)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def samples_with_ioc(db, kind, value, limit=100):
+    """Samples whose reports contain the given IOC, newest first."""
+    sample_ids = db.query(Ioc.sample_id).filter(
+        Ioc.kind == kind, Ioc.value == value).distinct()
+    return db.query(Sample).filter(Sample.id.in_(sample_ids)) \
+        .order_by(Sample.id.desc()).limit(limit).all()
+
+
+def top_rules(db, since, limit=20):
+    """Most frequently matched rules since a point in time."""
+    hits = func.count(Finding.id)
+    rows = db.query(Finding.rule, hits,
+                    func.count(func.distinct(Finding.sample_id))) \
+        .filter(Finding.created_at >= since) \
+        .group_by(Finding.rule).order_by(hits.desc()).limit(limit).all()
+    return [{"rule": rule, "hits": count, "samples": samples}
+            for rule, count, samples in rows]
+
+
+def sample_findings(db, sample_id):
+    """Verdicts, findings and IOCs indexed for one sample."""
+    return {
+        "verdicts": db.query(Verdict).filter(Verdict.sample_id == sample_id).all(),
+        "findings": db.query(Finding).filter(Finding.sample_id == sample_id).all(),
+        "iocs": db.query(Ioc).filter(Ioc.sample_id == sample_id).all(),
+    }
+
+
+def bulk_insert_samples(db, rows):
+    """
+    Insert many new samples with one executemany statement and return a
+    sha256 → id map. If a concurrent upload already inserted one of them,
+    fall back to row-by-row inserts that skip the conflicting rows.
+    """
+    if not rows:
+        return {}
+    try:
+        db.execute(insert(Sample), rows)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        for row in rows:
+            try:
+                db.execute(insert(Sample), [row])
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+
+    hashes = [row["hash_sha256"] for row in rows]
+    ids = {}
+    for i in range(0, len(hashes), 1000):
+        ids.update(db.query(Sample.hash_sha256, Sample.id)
+                   .filter(Sample.hash_sha256.in_(hashes[i:i + 1000])).all())
+    return ids
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "max": None}
+    return {"count": len(values),
+            "p50": round(values[len(values) // 2], 1),
+            "p95": round(values[min(int(len(values) * 0.95), len(values) - 1)], 1),
+            "max": round(values[-1], 1)}
+
+
+def queue_stats(db, window_seconds=3600):
+    """
+    Queue state per class (lane and priority): samples waiting, samples
+    under analysis, the age of the oldest waiting sample, and the wait time
+    percentiles (upload to claim, in seconds) of samples claimed within the
+    last `window_seconds`.
+    """
+    now = datetime.now()
+    classes = {}
+
+    def entry(lane, priority):
+        return classes.setdefault((lane, priority), {
+            "lane": lane, "priority": priority, "waiting": 0, "running": 0,
+            "oldest_wait": None, "waits": []})
+
+    rows = db.query(Sample.lane, Sample.priority, Sample.lease_expires >= now,
+                    func.count(Sample.id), func.min(Sample.upload_date)) \
+        .filter(Sample.analysis_pending == True, Sample.quarantined == False) \
+        .group_by(Sample.lane, Sample.priority, Sample.lease_expires >= now).all()
+    for lane, priority, running, count, oldest in rows:
+        stats = entry(lane, priority)
+        if running:
+            stats["running"] += count
+        else:
+            stats["waiting"] += count
+            age = (now - oldest).total_seconds() if oldest else None
+            if age is not None and (stats["oldest_wait"] or 0) < age:
+                stats["oldest_wait"] = round(age, 1)
+
+    claimed = db.query(Sample.lane, Sample.priority, Sample.upload_date, Sample.claimed_at) \
+        .filter(Sample.claimed_at >= now - timedelta(seconds=window_seconds)).all()
+    for lane, priority, upload_date, claimed_at in claimed:
+        entry(lane, priority)["waits"].append((claimed_at - upload_date).total_seconds())
+
+    def order(key):
+        lane, priority = key
+        return (LANES.index(lane) if lane in LANES else len(LANES), -(priority or 0))
+
+    result = []
+    for key in sorted(classes, key=order):
+        stats = classes[key]
+        stats["wait_seconds"] = percentiles(stats.pop("waits"))
+        result.append(stats)
+
+    submitters = db.query(Sample.submitter, func.count(Sample.id)) \
+        .filter(Sample.analysis_pending == True) \
+        .group_by(Sample.submitter).order_by(func.count(Sample.id).desc()).limit(20).all()
+
+    quarantined = db.query(func.count(Sample.id)) \
+        .filter(Sample.quarantined == True).scalar()
+
+    return {
+        "classes": result,
+        "submitters": [{"submitter": s, "pending": n} for s, n in submitters],
+        "quarantined": quarantined,
+        "max_attempts": MAX_ATTEMPTS,
+        "window_seconds": window_seconds,
+    }
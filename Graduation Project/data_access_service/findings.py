@@ -0,0 +1,94 @@
+import json
+
+from models import Finding, Ioc, Verdict
+
+# Column limits of the findings/iocs tables
+MAX_RULE = 255
+MAX_VALUE = 1024
+MAX_IOC = 512
+
+
+def extract_static(report):
+    """Verdict, findings and IOCs from a <sha256>_static.json report."""
+    verdict = {"verdict": report.get("verdict"), "score": report.get("score")}
+    findings = [{"rule": reason, "weight": None, "value": None}
+                for reason in report.get("reasons", [])]
+
+    iocs = [("url", url) for url in report.get("urls", [])]
+    pe = report.get("pe_analysis") or {}
+    iocs += [("api", api) for api in pe.get("suspicious_apis", [])]
+    return verdict, findings, iocs
+
+
+def extract_dynamic(report):
+    """Verdict, findings and IOCs from a <sha256>_dynamic.json report."""
+    verdict = {"verdict": report.get("risk_level"),
+               "score": report.get("combined_score")}
+
+    findings = []
+    for finding in report.get("state_findings", []) + report.get("etw_findings", []):
+        value = finding.get("value")
+        if value is None and finding.get("details"):
+            value = json.dumps(finding["details"], sort_keys=True)
+        findings.append({"rule": finding.get("name"),
+                         "weight": finding.get("weight"),
+                         "value": value})
+
+    network = report.get("network_analysis") or {}
+    return verdict, findings, extract_network(network)[2]
+
+
+def extract_network(report):
+    """IOCs from a <sha256>_network.json report (it carries no verdict)."""
+    iocs = []
+    for event in report.get("events", []):
+        if event.get("type") == "connection" and event.get("remote_ip"):
+            iocs.append(("ip", event["remote_ip"]))
+        elif event.get("type") == "dns" and event.get("query_ip"):
+            iocs.append(("ip", event["query_ip"]))
+    return None, [], iocs
+
+
+EXTRACTORS = {
+    "static": extract_static,
+    "dynamic": extract_dynamic,
+    "network": extract_network,
+}
+
+
+def index_report(db, sample_id, source, report):
+    """
+    Replace the verdict, findings and IOCs of one report source for a
+    sample with the ones parsed from `report`. Re-ingesting a report is
+    therefore idempotent.
+    """
+    verdict, findings, iocs = EXTRACTORS[source](report)
+
+    for model in (Verdict, Finding, Ioc):
+        db.query(model).filter(model.sample_id == sample_id,
+                               model.source == source).delete()
+
+    if verdict is not None:
+        db.add(Verdict(sample_id=sample_id, source=source,
+                       verdict=verdict["verdict"], score=verdict["score"]))
+
+    for finding in findings:
+        if not finding["rule"]:
+            continue
+        value = finding["value"]
+        db.add(Finding(sample_id=sample_id, source=source,
+                       rule=str(finding["rule"])[:MAX_RULE],
+                       weight=finding["weight"],
+                       value=str(value)[:MAX_VALUE] if value is not None else None))
+
+    # The same IOC is usually seen many times in one report, sometimes in
+    # another case, which the unique index treats as equal under MariaDB's
+    # case-insensitive collation: keep the first spelling
+    unique = {}
+    for kind, value in iocs:
+        value = str(value)[:MAX_IOC]
+        unique.setdefault((kind, value.lower()), (kind, value))
+    for kind, value in sorted(unique.values()):
+        db.add(Ioc(sample_id=sample_id, source=source, kind=kind, value=value))
+
+    db.commit()
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import uuid
+
+import pyzipper
+
+ZIP_PASSWORD = "infected"
+CHUNK_SIZE = 1024 * 1024  # 1 MiB per read keeps memory flat for any file size
+
+
+def hash_sample(fileobj):
+    """
+    Hash a sample from a file-like object in chunks.
+
+    Returns a dict with the md5/sha1/sha256 hex digests and the file size.
+    """
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    sha256 = hashlib.sha256()
+    file_size = 0
+
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+        md5.update(chunk)
+        sha1.update(chunk)
+        sha256.update(chunk)
+        file_size += len(chunk)
+
+    return {
+        "hash_md5": md5.hexdigest(),
+        "hash_sha1": sha1.hexdigest(),
+        "hash_sha256": sha256.hexdigest(),
+        "file_size": file_size,
+    }
+
+
+def zip_sample(fileobj, upload_dir, hash_sha256):
+    """
+    Stream an already hashed sample into uploads/<sha256>.zip.
+
+    Returns the zip path.
+    """
+    tmp_path = os.path.join(upload_dir, f".{uuid.uuid4().hex}.zip.part")
+    zip_path = os.path.join(upload_dir, f"{hash_sha256}.zip")
+
+    try:
+        with pyzipper.AESZipFile(tmp_path, 'w', compression=pyzipper.ZIP_DEFLATED,
+                                 encryption=pyzipper.WZ_AES) as zipf:
+            zipf.setpassword(ZIP_PASSWORD.encode())
+            with zipf.open("sample", "w", force_zip64=True) as dest:
+                for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                    dest.write(chunk)
+        os.replace(tmp_path, zip_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return zip_path
+
+
+def store_sample(fileobj, upload_dir):
+    """
+    Read a sample from a file-like object in chunks and, in the same pass,
+    feed the md5/sha1/sha256 digests and the AES-encrypted zip writer.
+
+    The zip is written to a temporary name first because its final name
+    (<sha256>.zip) is only known once the whole file has been read.
+
+    Returns a dict with the three hashes, the file size and the zip path.
+    """
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    sha256 = hashlib.sha256()
+    file_size = 0
+
+    tmp_path = os.path.join(upload_dir, f".{uuid.uuid4().hex}.zip.part")
+
+    try:
+        with pyzipper.AESZipFile(tmp_path, 'w', compression=pyzipper.ZIP_DEFLATED,
+                                 encryption=pyzipper.WZ_AES) as zipf:
+            zipf.setpassword(ZIP_PASSWORD.encode())
+            # force_zip64 because the size is unknown until the stream ends
+            with zipf.open("sample", "w", force_zip64=True) as dest:
+                for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                    md5.update(chunk)
+                    sha1.update(chunk)
+                    sha256.update(chunk)
+                    dest.write(chunk)
+                    file_size += len(chunk)
+
+        hash_sha256 = sha256.hexdigest()
+        zip_path = os.path.join(upload_dir, f"{hash_sha256}.zip")
+        os.replace(tmp_path, zip_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return {
+        "hash_md5": md5.hexdigest(),
+        "hash_sha1": sha1.hexdigest(),
+        "hash_sha256": hash_sha256,
+        "file_size": file_size,
+        "zip_path": zip_path,
+    }
+
+
+# Bulk ingestion: the functions below run in worker processes, so they take
+# paths instead of file objects
+
+def hash_paths(paths):
+    results = []
+    for path in paths:
+        with open(path, "rb") as f:
+            results.append(hash_sample(f))
+    return results
+
+
+def zip_paths(jobs, upload_dir):
+    """jobs: list of (path, sha256)."""
+    for path, hash_sha256 in jobs:
+        with open(path, "rb") as f:
+            zip_sample(f, upload_dir, hash_sha256)
+
+
+def extract_archive(archive_path, dest_dir, password=None, max_members=None,
+                    max_member_bytes=None, max_total_bytes=None):
+    """
+    Extract the regular files of a (optionally AES encrypted) zip archive
+    into dest_dir under index-based names, so member paths can never escape
+    it. Returns a list of (original member name, extracted path).
+
+    Raises ValueError past max_members files, a member bigger than
+    max_member_bytes, or more than max_total_bytes extracted in all. Sizes
+    are checked against the zip headers first, then counted while
+    extracting, since headers can lie.
+    """
+    members = []
+    with pyzipper.AESZipFile(archive_path) as zipf:
+        if password:
+            zipf.setpassword(password.encode())
+        infos = [info for info in zipf.infolist() if not info.is_dir()]
+        if max_members is not None and len(infos) > max_members:
+            raise ValueError(
+                f"Archive has {len(infos)} files, the limit is {max_members}")
+        for info in infos:
+            if max_member_bytes is not None and info.file_size > max_member_bytes:
+                raise ValueError(
+                    f"{info.filename} is {info.file_size} bytes, the limit is {max_member_bytes}")
+        if max_total_bytes is not None and sum(info.file_size for info in infos) > max_total_bytes:
+            raise ValueError(f"Archive expands past {max_total_bytes} bytes")
+
+        total = 0
+        for index, info in enumerate(infos):
+            path = os.path.join(dest_dir, str(index))
+            size = 0
+            with zipf.open(info) as src, open(path, "wb") as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    size += len(chunk)
+                    total += len(chunk)
+                    if max_member_bytes is not None and size > max_member_bytes:
+                        raise ValueError(f"{info.filename} is over {max_member_bytes} bytes")
+                    if max_total_bytes is not None and total > max_total_bytes:
+                        raise ValueError(f"Archive expands past {max_total_bytes} bytes")
+                    dst.write(chunk)
+            members.append((os.path.basename(info.filename), path))
+    return members
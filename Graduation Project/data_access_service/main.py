@@ -1,32 +1,87 @@
+import asyncio
+import hashlib
 import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
 
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, Depends, HTTPException, Request, Response, Header
 import uvicorn
-import hashlib
-import pyzipper
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from database import engine, Base, get_db
+from database import engine, Base, get_db, SessionLocal, DB_POOL_SIZE, DB_MAX_OVERFLOW
 from models import Sample
+from ingest import hash_sample, zip_sample, hash_paths, zip_paths, extract_archive
+from report_store import ReportStore, REPORT_KINDS, parse_report_filename
+from report_store import BundleError, DigestMismatch, verify_bundle, SHA256_RE
+from crud import list_samples, SAMPLE_FIELDS, ANALYSIS_STATUSES, MAX_PAGE_SIZE
+from crud import claim_samples, extend_lease, release_lease, requeue_sample, quarantine_expired
+from crud import samples_with_ioc, top_rules, sample_findings
+from crud import bulk_insert_samples, queue_stats
+from crud import STAGES, STAGE_STATUSES, FINAL_STAGE_STATUSES, stage_statuses
+from scheduling import POLICIES, DEFAULT_POLICY, LANES, MIN_PRIORITY, MAX_PRIORITY, lane_for
+from findings import index_report
+from cache import SampleCache
+from presence import PresenceRegistry
+from datetime import datetime, timedelta
+import json
 import os
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import redis
+import redis.asyncio as aioredis
+import pyzipper
+import anyio.to_thread
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)  # Make folder if it doesn't exist
 
+# Analysis reports, sharded by sha256 and compressed at rest (gzip or zstd)
+REPORT_DIR = os.getenv("REPORT_DIR", "reports")
+reports = ReportStore(REPORT_DIR, codec=os.getenv("REPORT_CODEC", "gzip"))
+
 # Create tables
 Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
+
+# Sync endpoints and run_in_threadpool share anyio's thread limiter; size it
+# to the DB pool so requests queue for a thread rather than a connection
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE",
+                                str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+
+
+@app.on_event("startup")
+async def size_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+
 # Connect to Redis
 r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+# Async client for the long-lived pub/sub subscriptions of event streams
+ar = aioredis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+
+# Presence of core/host workers, one TTL'd key per worker
+presence = PresenceRegistry(r)
+
+# Read-through cache for sample metadata and listing pages
+cache = SampleCache(
+    r,
+    ttl=int(os.getenv("CACHE_TTL", "300")),
+    max_entry_bytes=int(os.getenv("CACHE_MAX_ENTRY_BYTES", str(64 * 1024))),
+    max_pages=int(os.getenv("CACHE_MAX_PAGES", "1000")),
+)
 
 
 # Pydantic model for analysis status update
 class AnalysisStatusUpdate(BaseModel):
     static_analysis: bool = None
     dynamic_analysis: bool = None
+    # Stage transitions: queued, running, done or failed
+    static_status: str = None
+    dynamic_status: str = None
+    network_status: str = None
 
 
 @app.get("/")
@@ -34,54 +89,331 @@ def read_root():
     return {"hello": "world"}
 
 
-@app.post("/samples/upload/")
-async def create_sample(file: UploadFile = File(...), db: Session = Depends(get_db)):
+# Redis set holding the sha256 of every stored sample, used to short-circuit
+# re-uploads before any zip or DB work is done
+KNOWN_SAMPLES_KEY = "samples:sha256"
 
-    # Read file content
-    contents = await file.read()
+# Pub/sub channel announcing claimable samples, so cores dispatch at once
+# instead of waiting for their next poll
+NEW_SAMPLES_CHANNEL = "samples:new"
 
-    # Get original filename
-    file_name = file.filename
+# Pub/sub channel prefix carrying a sample's stage statuses as they change,
+# relayed to the UI by /samples/{sha256}/events
+STATUS_CHANNEL = "samples:status:"
 
-    # Get file size and type
-    file_size = len(contents)
+# Seconds between keep-alive comments on an idle event stream
+EVENTS_KEEPALIVE = int(os.getenv("EVENTS_KEEPALIVE", "15"))
+
+
+def sample_to_dict(sample, **extra):
+    data = {c.name: getattr(sample, c.name) for c in sample.__table__.columns}
+    data.update(extra)
+    return data
+
+
+def is_known_sample(hash_sha256):
+    try:
+        return bool(r.sismember(KNOWN_SAMPLES_KEY, hash_sha256))
+    except redis.RedisError as e:
+        print(f"Known samples cache unavailable: {e}")
+        return False
 
-    # Simple file type extraction from filename
-    file_extension = os.path.splitext(file_name)[1].lstrip('.').lower()
 
-    # Calculate hashes
-    def calc_hash(file_bytes, algo):
-        hash_func = hashlib.new(algo)
-        hash_func.update(file_bytes)
-        return hash_func.hexdigest()
+def publish_new_samples(*hashes):
+    """Tell subscribed cores that samples are waiting to be claimed."""
+    try:
+        pipe = r.pipeline()
+        for hash_sha256 in hashes:
+            pipe.publish(NEW_SAMPLES_CHANNEL, hash_sha256)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Could not publish new samples: {e}")
 
-    hash_md5 = calc_hash(contents, 'md5')
-    hash_sha1 = calc_hash(contents, 'sha1')
-    hash_sha256 = calc_hash(contents, 'sha256')
 
-    # Create zip file path
-    zip_filename = os.path.join(UPLOAD_DIR, f"{hash_sha256}.zip")
+def publish_status(sample):
+    """Push a sample's stage statuses to the UIs watching it."""
+    try:
+        r.publish(STATUS_CHANNEL + sample.hash_sha256, json.dumps(stage_statuses(sample)))
+    except redis.RedisError as e:
+        print(f"Could not publish sample status: {e}")
+
+
+def remember_sample(hash_sha256):
+    try:
+        r.sadd(KNOWN_SAMPLES_KEY, hash_sha256)
+    except redis.RedisError as e:
+        print(f"Known samples cache unavailable: {e}")
 
-    # Create password-protected zip
-    with pyzipper.AESZipFile(zip_filename, 'w', compression=pyzipper.ZIP_DEFLATED,
-                             encryption=pyzipper.WZ_AES) as zipf:
-        zipf.setpassword("infected".encode())  # set password
-        zipf.writestr("sample", contents)  # add file to zip
 
-    # Create Sample instance
+@app.on_event("startup")
+def warm_known_samples():
+    """
+    Load every stored sha256 into the known samples set.
+    """
+    db = SessionLocal()
+    try:
+        pipe = r.pipeline()
+        rows = db.query(Sample.hash_sha256).filter(
+            Sample.hash_sha256.isnot(None)).yield_per(10000)
+        for count, (hash_sha256,) in enumerate(rows, 1):
+            pipe.sadd(KNOWN_SAMPLES_KEY, hash_sha256)
+            if count % 10000 == 0:
+                pipe.execute()
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Could not warm known samples cache: {e}")
+    finally:
+        db.close()
+
+
+def find_duplicate(db, hash_sha256):
+    """Return the stored record of a known sample, or None for a new one."""
+    if not is_known_sample(hash_sha256):
+        return None
+    return db.query(Sample).filter(Sample.hash_sha256 == hash_sha256).first()
+
+
+def check_priority(priority):
+    if not MIN_PRIORITY <= priority <= MAX_PRIORITY:
+        raise HTTPException(
+            status_code=400,
+            detail=f"priority must be between {MIN_PRIORITY} and {MAX_PRIORITY}")
+
+
+def insert_sample(db, file_name, file_type, hashes, priority=0, submitter=None):
+    """Insert a new sample and return it as a dict with its duplicate flag."""
     sample = Sample(
-        hash_md5=hash_md5,
-        hash_sha1=hash_sha1,
-        hash_sha256=hash_sha256,
+        hash_md5=hashes["hash_md5"],
+        hash_sha1=hashes["hash_sha1"],
+        hash_sha256=hashes["hash_sha256"],
         file_name=file_name,
-        file_size=file_size,
-        file_type=file_extension
+        file_size=hashes["file_size"],
+        file_type=file_type,
+        priority=priority,
+        submitter=submitter,
+        lane=lane_for(hashes["file_size"])
     )
 
     db.add(sample)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent upload of the same sample
+        db.rollback()
+        existing = db.query(Sample).filter(
+            Sample.hash_sha256 == hashes["hash_sha256"]).first()
+        if existing is None:
+            raise HTTPException(
+                status_code=409, detail="Sample conflicts with an existing record")
+        remember_sample(hashes["hash_sha256"])
+        return sample_to_dict(existing, duplicate=True)
+
     db.refresh(sample)
-    return sample
+    remember_sample(sample.hash_sha256)
+    cache.invalidate_listings()
+    publish_new_samples(sample.hash_sha256)
+    return sample_to_dict(sample, duplicate=False)
+
+
+@app.post("/samples/upload/")
+async def create_sample(file: UploadFile = File(...),
+                        priority: int = Form(0),
+                        submitter: str = Form(None),
+                        db: Session = Depends(get_db)):
+    check_priority(priority)
+
+    # Every blocking step (file I/O, Redis, SQL) runs in the threadpool so
+    # the event loop keeps serving other requests
+
+    # Get original filename
+    file_name = file.filename
+
+    # Simple file type extraction from filename
+    file_extension = os.path.splitext(file_name)[1].lstrip('.').lower()
+
+    # Hash the upload in one streaming pass
+    hashes = await run_in_threadpool(hash_sample, file.file)
+
+    # Known sample → return the existing record, skip zip and insert
+    existing = await run_in_threadpool(find_duplicate, db, hashes["hash_sha256"])
+    if existing is not None:
+        return sample_to_dict(existing, duplicate=True)
+
+    # New sample → stream it from the spooled upload into the
+    # password-protected zip
+    await run_in_threadpool(file.file.seek, 0)
+    await run_in_threadpool(zip_sample, file.file, UPLOAD_DIR, hashes["hash_sha256"])
+
+    return await run_in_threadpool(
+        insert_sample, db, file_name, file_extension, hashes, priority, submitter)
+
+# Bulk ingestion: hashing and zipping run in a process pool created on first use
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", str(os.cpu_count() or 1)))
+MAX_BULK_FILES = int(os.getenv("MAX_BULK_FILES", "20000"))
+# Uncompressed size limits for bulk archives, per file and in all, so a
+# small zip cannot fill the upload disk
+MAX_ARCHIVE_MEMBER_BYTES = int(os.getenv("MAX_ARCHIVE_MEMBER_BYTES", str(256 * 1024 * 1024)))
+MAX_ARCHIVE_BYTES = int(os.getenv("MAX_ARCHIVE_BYTES", str(4 * 1024 * 1024 * 1024)))
+# Files per worker task; batching keeps inter-process overhead low for small files
+BULK_BATCH_SIZE = 64
+bulk_pool = None
+
+
+def get_bulk_pool():
+    global bulk_pool
+    if bulk_pool is None:
+        bulk_pool = ProcessPoolExecutor(max_workers=BULK_WORKERS)
+    return bulk_pool
+
+
+@app.on_event("shutdown")
+def shutdown_bulk_pool():
+    if bulk_pool is not None:
+        bulk_pool.shutdown()
+
+
+def save_upload(upload, path):
+    with open(path, "wb") as f:
+        shutil.copyfileobj(upload.file, f)
+
+
+def spool_uploads(files, dest_dir):
+    """Copy uploaded files to dest_dir so worker processes can read them."""
+    members = []
+    for index, upload in enumerate(files):
+        path = os.path.join(dest_dir, f"f{index}")
+        save_upload(upload, path)
+        members.append((os.path.basename(upload.filename), path))
+    return members
+
+
+def batches(items, size=BULK_BATCH_SIZE):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def find_known_samples(db, hashes):
+    """Map sha256 → stored Sample for the hashes that are already known."""
+    try:
+        flags = r.smismember(KNOWN_SAMPLES_KEY, hashes) if hashes else []
+    except redis.RedisError as e:
+        print(f"Known samples cache unavailable: {e}")
+        flags = [True] * len(hashes)  # let the DB decide
+
+    candidates = [h for h, known in zip(hashes, flags) if known]
+    found = {}
+    for i in range(0, len(candidates), 1000):
+        for sample in db.query(Sample).filter(
+                Sample.hash_sha256.in_(candidates[i:i + 1000])):
+            found[sample.hash_sha256] = sample
+    return found
+
+
+def announce_new_samples(hashes):
+    """Record newly stored samples as known and tell listings and cores about them."""
+    try:
+        r.sadd(KNOWN_SAMPLES_KEY, *hashes)
+    except redis.RedisError as e:
+        print(f"Known samples cache unavailable: {e}")
+    cache.invalidate_listings()
+    publish_new_samples(*hashes)
+
+
+@app.post("/samples/bulk")
+async def create_samples_bulk(files: List[UploadFile] = File(None),
+                              archive: UploadFile = File(None),
+                              password: str = Form(None),
+                              priority: int = Form(0),
+                              submitter: str = Form(None),
+                              db: Session = Depends(get_db)):
+    """
+    Ingest many samples at once, sent as multiple `files` and/or one zip
+    `archive` (AES archives need `password`). Members are hashed and zipped
+    in a process pool, and all new samples are inserted in one statement.
+    Returns one result per file, in order, with a duplicate flag.
+    """
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="No files or archive provided")
+    check_priority(priority)
+
+    # Like create_sample, every blocking step (file I/O, Redis, SQL) runs
+    # in the threadpool; removing the work dir alone can mean 20,000 files
+    work_dir = await run_in_threadpool(tempfile.mkdtemp, prefix=".bulk-", dir=UPLOAD_DIR)
+    try:
+        members = await run_in_threadpool(spool_uploads, files or [], work_dir)
+        if archive is not None:
+            archive_path = os.path.join(work_dir, "archive.zip")
+            await run_in_threadpool(save_upload, archive, archive_path)
+            member_dir = os.path.join(work_dir, "archive")
+            await run_in_threadpool(os.makedirs, member_dir)
+            try:
+                members += await run_in_threadpool(
+                    extract_archive, archive_path, member_dir, password,
+                    MAX_BULK_FILES - len(members), MAX_ARCHIVE_MEMBER_BYTES, MAX_ARCHIVE_BYTES)
+            except (pyzipper.BadZipFile, RuntimeError, ValueError) as e:
+                raise HTTPException(status_code=400, detail=f"Bad archive: {e}")
+
+        if len(members) > MAX_BULK_FILES:
+            raise HTTPException(
+                status_code=400, detail=f"At most {MAX_BULK_FILES} files per request")
+
+        loop = asyncio.get_running_loop()
+        pool = get_bulk_pool()
+
+        # Pass 1: hash everything in parallel
+        hashed = await asyncio.gather(*(
+            loop.run_in_executor(pool, hash_paths, batch)
+            for batch in batches([path for _, path in members])))
+        hashes = [h for batch in hashed for h in batch]
+
+        known = await run_in_threadpool(
+            find_known_samples, db, [h["hash_sha256"] for h in hashes])
+
+        # First occurrence of each unknown hash is new, the rest are duplicates
+        new = {}
+        for index, h in enumerate(hashes):
+            if h["hash_sha256"] not in known:
+                new.setdefault(h["hash_sha256"], index)
+
+        # Pass 2: zip only the new samples, in parallel
+        await asyncio.gather(*(
+            loop.run_in_executor(pool, zip_paths, batch, UPLOAD_DIR)
+            for batch in batches([(members[index][1], sha256)
+                                  for sha256, index in new.items()])))
+
+        now = datetime.now()
+        rows = []
+        for sha256, index in new.items():
+            file_name = members[index][0]
+            rows.append({
+                "hash_md5": hashes[index]["hash_md5"],
+                "hash_sha1": hashes[index]["hash_sha1"],
+                "hash_sha256": sha256,
+                "file_name": file_name,
+                "file_size": hashes[index]["file_size"],
+                "file_type": os.path.splitext(file_name)[1].lstrip('.').lower(),
+                "upload_date": now,
+                "priority": priority,
+                "submitter": submitter,
+                "lane": lane_for(hashes[index]["file_size"]),
+            })
+        ids = await run_in_threadpool(bulk_insert_samples, db, rows)
+    finally:
+        await run_in_threadpool(shutil.rmtree, work_dir, ignore_errors=True)
+
+    if new:
+        await run_in_threadpool(announce_new_samples, list(new))
+
+    results = []
+    for index, ((file_name, _), h) in enumerate(zip(members, hashes)):
+        sha256 = h["hash_sha256"]
+        stored = known.get(sha256)
+        results.append({
+            "file_name": file_name,
+            "hash_sha256": sha256,
+            "id": stored.id if stored is not None else ids.get(sha256),
+            "duplicate": new.get(sha256) != index,
+        })
+    return results
 
 # Get sample metadata by ID or SHA256 hash, and return the file if &download=1 is specified
 
@@ -96,80 +428,495 @@ def read_sample(identifier: str, download: int = 0, db: Session = Depends(get_db
                 return {"error": "File not found"}
             return FileResponse(zip_filename, media_type='application/zip', filename=f"{identifier}.zip")
 
+        cached = cache.get_sample(identifier)
+        if cached is not None:
+            return cached
+        generation = cache.generation()
         sample = db.query(Sample).filter(
             Sample.hash_sha256 == identifier).first()
     elif identifier.isdigit():  # ID
+        cached = cache.get_sample(identifier)
+        if cached is not None:
+            return cached
+        generation = cache.generation()
         sample = db.query(Sample).filter(Sample.id == int(identifier)).first()
     if sample is None:
         return {"error": "Sample not found"}
-    return sample
+
+    data = sample_to_dict(sample)
+    cache.set_sample(data, generation)
+    return data
 
 
 @app.get("/samples")
-def read_samples(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    samples = db.query(Sample).offset(skip).limit(limit).all()
-    return samples
+def read_samples(response: Response, limit: int = 10, cursor: str = None,
+                 status: str = None, file_type: str = None,
+                 date_from: datetime = None, date_to: datetime = None,
+                 fields: str = None, db: Session = Depends(get_db)):
+    """
+    Returns a page of samples, newest first. The cursor of the next page is
+    sent in the X-Next-Cursor header; pass it back as ?cursor= to continue.
+
+    Optional filters: status (pending/analyzed), file_type and an upload
+    date range. ?fields=id,hash_sha256 returns only the listed columns.
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if status is not None and status not in ANALYSIS_STATUSES:
+        raise HTTPException(
+            status_code=400, detail=f"status must be one of {', '.join(ANALYSIS_STATUSES)}")
+
+    field_list = None
+    if fields:
+        field_list = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in field_list if f not in SAMPLE_FIELDS]
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
 
+    params = {"limit": limit, "cursor": cursor, "status": status,
+              "file_type": file_type, "date_from": date_from,
+              "date_to": date_to, "fields": field_list}
+    page_key = cache.page_key(params)
+    page = cache.get_page(page_key)
 
-@app.get("/samples/unanalyzed/first")
-def read_first_unanalyzed_sample(db: Session = Depends(get_db)):
+    if page is None:
+        try:
+            samples, next_cursor = list_samples(db, **params)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        page = {"samples": samples, "next_cursor": next_cursor}
+        cache.set_page(page_key, page)
+
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["samples"]
+
+
+def invalidate_cached_sample(db, sha256):
+    sample_id = db.query(Sample.id).filter(Sample.hash_sha256 == sha256).scalar()
+    if sample_id is not None:
+        cache.invalidate_sample(sample_id, sha256)
+
+
+class ClaimRequest(BaseModel):
+    worker: str
+    count: int = 1
+    lease_seconds: int = 600
+    policy: str = DEFAULT_POLICY  # fifo, priority or fair_share
+    lane: str = None  # only claim from this lane
+
+
+class LeaseRequest(BaseModel):
+    worker: str
+    lease_seconds: int = 600
+
+
+@app.post("/samples/claim")
+def claim(request: ClaimRequest, db: Session = Depends(get_db)):
     """
-    Returns the metadata of the first sample where either static_analysis 
-    or dynamic_analysis equals zero/False, ordered by lowest id.
+    Atomically claims up to `count` pending samples for a worker, in the
+    order picked by the scheduling policy. Each claimed sample is leased to that worker for `lease_seconds`;
+    if the lease is neither extended nor completed it goes back in the queue.
+    Returns an empty list when nothing is pending.
     """
-    sample = db.query(Sample).filter(
-        (Sample.static_analysis == False) | (Sample.dynamic_analysis == False)
-    ).order_by(Sample.id.asc()).first()
+    if not 1 <= request.count <= 100:
+        raise HTTPException(
+            status_code=400, detail="count must be between 1 and 100")
+    if request.policy not in POLICIES:
+        raise HTTPException(
+            status_code=400, detail=f"policy must be one of {', '.join(POLICIES)}")
+    if request.lane is not None and request.lane not in LANES:
+        raise HTTPException(
+            status_code=400, detail=f"lane must be one of {', '.join(LANES)}")
+    # Samples whose worker vanished on their last attempt leave the queue
+    for sample_id, sha256 in quarantine_expired(db):
+        cache.invalidate_sample(sample_id, sha256)
+    claimed = claim_samples(
+        db, request.worker, request.count, request.lease_seconds,
+        request.policy, request.lane)
+    for sample in claimed:
+        cache.invalidate_sample(sample.id, sample.hash_sha256)
+    return claimed
 
-    if sample is None:
+
+@app.get("/queue/stats")
+def get_queue_stats(window: int = 3600, db: Session = Depends(get_db)):
+    """
+    Queue state per lane and priority: waiting and running counts, oldest
+    waiting sample, and wait time percentiles over the last `window` seconds.
+    """
+    return {"policy": DEFAULT_POLICY, **queue_stats(db, window)}
+
+
+@app.post("/samples/{sha256}/lease")
+def renew_lease(sha256: str, request: LeaseRequest, db: Session = Depends(get_db)):
+    """
+    Extends the lease a worker holds on a sample.
+    """
+    if not extend_lease(db, sha256, request.worker, request.lease_seconds):
         raise HTTPException(
-            status_code=404, detail="No unanalyzed samples found")
-    return sample
+            status_code=409, detail="Sample is not leased to this worker")
+    invalidate_cached_sample(db, sha256)
+    return {"status": "success"}
+
+
+@app.delete("/samples/{sha256}/lease")
+def drop_lease(sha256: str, worker: str, failed: bool = False, error: str = None,
+               db: Session = Depends(get_db)):
+    """
+    Releases a worker's lease so the sample can be claimed again. With
+    `failed` the attempt counts against the sample, which is quarantined
+    once it runs out of attempts.
+    """
+    if not release_lease(db, sha256, worker, failed, error):
+        raise HTTPException(
+            status_code=409, detail="Sample is not leased to this worker")
+    invalidate_cached_sample(db, sha256)
+    publish_new_samples(sha256)
+    return {"status": "success"}
+
+
+@app.post("/samples/{sha256}/requeue")
+def requeue(sha256: str, db: Session = Depends(get_db)):
+    """
+    Takes a sample out of quarantine and gives it a fresh set of attempts.
+    """
+    if not requeue_sample(db, sha256):
+        raise HTTPException(
+            status_code=404, detail="No pending sample with this hash")
+    invalidate_cached_sample(db, sha256)
+    publish_new_samples(sha256)
+    return {"status": "success"}
 
 
 @app.post("/samples/{sha256}/analysis")
 def update_sample_analysis(sha256: str, analysis_status: AnalysisStatusUpdate, db: Session = Depends(get_db)):
     """
-    Updates the static_analysis and/or dynamic_analysis status for a sample by SHA256 hash.
+    Updates the analysis status of a sample by SHA256 hash, either per stage
+    (static_status, dynamic_status, network_status) or with the
+    static_analysis / dynamic_analysis flags. A stage that is done sets its
+    flag, so the static results count as soon as the static stage ends.
     """
+    for stage in STAGES:
+        status = getattr(analysis_status, f"{stage}_status")
+        if status is not None and status not in STAGE_STATUSES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{stage}_status must be one of {', '.join(STAGE_STATUSES)}")
+
     sample = db.query(Sample).filter(Sample.hash_sha256 == sha256).first()
 
     if sample is None:
         return {"error": "Sample not found"}
 
+    for stage in STAGES:
+        status = getattr(analysis_status, f"{stage}_status")
+        if status is not None:
+            setattr(sample, f"{stage}_status", status)
+    if analysis_status.static_status is not None:
+        sample.static_analysis = analysis_status.static_status == "done"
+    if analysis_status.dynamic_status is not None:
+        sample.dynamic_analysis = analysis_status.dynamic_status == "done"
+
     if analysis_status.static_analysis is not None:
         sample.static_analysis = analysis_status.static_analysis
+        if analysis_status.static_analysis and sample.static_status not in FINAL_STAGE_STATUSES:
+            sample.static_status = "done"
     if analysis_status.dynamic_analysis is not None:
         sample.dynamic_analysis = analysis_status.dynamic_analysis
+        if analysis_status.dynamic_analysis and sample.dynamic_status not in FINAL_STAGE_STATUSES:
+            sample.dynamic_status = "done"
+
+    # Fully analyzed samples leave the work queue
+    sample.analysis_pending = not (
+        sample.static_analysis and sample.dynamic_analysis)
+    if not sample.analysis_pending:
+        sample.claimed_by = None
+        sample.lease_expires = None
+        # Stages never reported on their own (network, or an older VM
+        # agent) ended with the analysis
+        for stage in STAGES:
+            if getattr(sample, f"{stage}_status") not in FINAL_STAGE_STATUSES:
+                setattr(sample, f"{stage}_status", "done")
 
     db.commit()
     db.refresh(sample)
+    cache.invalidate_sample(sample.id, sample.hash_sha256)
+    publish_status(sample)
     return sample
 
 
+def current_status(sha256):
+    """(stage statuses, still pending) of a sample, or None if it is unknown."""
+    db = SessionLocal()
+    try:
+        sample = db.query(Sample).filter(Sample.hash_sha256 == sha256).first()
+        if sample is None:
+            return None
+        return stage_statuses(sample), sample.analysis_pending
+    finally:
+        db.close()
+
+
+@app.get("/samples/{sha256}/events")
+async def sample_events(sha256: str, request: Request):
+    """
+    Server-sent events with the stage statuses of a sample: the current
+    ones first, then one event per change. The stream ends once every
+    stage is done or failed, or right away for an analyzed sample.
+    """
+    pubsub = ar.pubsub()
+    # Subscribe before reading the current state so no change slips between
+    await pubsub.subscribe(STATUS_CHANNEL + sha256)
+    current = await run_in_threadpool(current_status, sha256)
+    if current is None:
+        await pubsub.aclose()
+        raise HTTPException(status_code=404, detail="Sample not found")
+    status, pending = current
+
+    async def stream(status):
+        try:
+            yield f"data: {json.dumps(status)}\n\n"
+            while pending and not all(s in FINAL_STAGE_STATUSES for s in status.values()):
+                if await request.is_disconnected():
+                    break
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=EVENTS_KEEPALIVE)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                status = json.loads(message["data"])
+                yield f"data: {message['data']}\n\n"
+        finally:
+            await pubsub.aclose()
+
+    return StreamingResponse(stream(status), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+def parse_range(range_header, total):
+    """Parse a single "bytes=start-end" range. Returns (start, end) or None if unsatisfiable."""
+    units, _, spec = range_header.partition("=")
+    if units.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else total - 1
+        else:  # suffix range: the last N bytes
+            start = max(total - int(last), 0)
+            end = total - 1
+    except ValueError:
+        return None
+    end = min(end, total - 1)
+    if start > end:
+        return None
+    return start, end
+
+
+def report_response(request, sha256, kind):
+    """
+    Serve a stored report as raw bytes. The stored compressed bytes are
+    sent as-is when the client accepts their Content-Encoding, otherwise
+    they are decompressed. Supports ETag/If-None-Match and single ranges.
+    """
+    meta = reports.get(sha256, kind)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+
+    accepted = [e.split(";")[0].strip().lower()
+                for e in request.headers.get("accept-encoding", "").split(",")]
+    encoded = meta["encoding"] in accepted
+
+    # Each representation gets its own strong ETag
+    etag = f'"{meta["etag"]}-{meta["encoding"]}"' if encoded else f'"{meta["etag"]}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Vary": "Accept-Encoding"}
+    if encoded:
+        headers["Content-Encoding"] = meta["encoding"]
+
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    if encoded:
+        total = meta["stored_size"]
+
+        def read(start, end):
+            return reports.read_encoded(meta, start, end)
+    else:
+        body = reports.read_decoded(meta)
+        total = len(body)
+
+        def read(start, end):
+            return body[start:end + 1]
+
+    range_header = request.headers.get("range")
+    if range_header and total:
+        byte_range = parse_range(range_header, total)
+        if byte_range is None:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+        return Response(read(start, end), status_code=206,
+                        media_type=meta["media_type"], headers=headers)
+
+    return Response(read(0, None if encoded else total - 1),
+                    media_type=meta["media_type"], headers=headers)
+
+
+def index_stored_report(db, sha256, kind):
+    """Parse a stored JSON report into the verdicts/findings/iocs tables."""
+    source, ext = kind.split(".")
+    if ext != "json":
+        return
+
+    sample = db.query(Sample).filter(Sample.hash_sha256 == sha256).first()
+    if sample is None:
+        print(f"Report {sha256}_{kind} has no sample, not indexed")
+        return
+
+    try:
+        report = json.loads(reports.read_decoded(reports.get(sha256, kind)))
+        index_report(db, sample.id, source, report)
+    except (ValueError, AttributeError, TypeError, IntegrityError) as e:
+        # The report itself is stored; only its index is missing
+        db.rollback()
+        print(f"Could not index report {sha256}_{kind}: {e}")
+
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    contents = await file.read()
+def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    # sync endpoint → runs in the threadpool
+    filename = os.path.basename(file.filename)
+
+    # Analysis reports go to the report store, anything else to uploads
+    report_key = parse_report_filename(filename)
+    if report_key:
+        reports.save(*report_key, file.file)
+        index_stored_report(db, *report_key)
+    else:
+        file_path = os.path.join(UPLOAD_DIR, filename)
+        with open(file_path, "wb") as f:
+            shutil.copyfileobj(file.file, f)
+
+    return {"status": "success", "filename": filename}
+
 
-    # save to disk in uploads folder
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as f:
-        f.write(contents)
+def report_sha256(sha256):
+    """The sample sha256 of a report URL, lowercased; 404 if it is not one."""
+    sha256 = sha256.lower()
+    if not SHA256_RE.match(sha256):
+        raise HTTPException(status_code=404, detail="Sample not found")
+    return sha256
 
 
-# @app.post("/upload")
-# async def upload_file(file: UploadFile = File(...)):
-#     filename = Path(file.filename).name
-#     file_path = os.path.join(UPLOAD_DIR, filename)
+def store_bundle(sha256, path, expected_digest):
+    """Verify a spooled report bundle, then store and index its reports."""
+    if expected_digest and file_sha256(path) != expected_digest.lower():
+        raise HTTPException(status_code=422, detail="Bundle does not match X-Content-SHA256")
+    try:
+        manifest = verify_bundle(path)
+    except BundleError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if str(manifest.get("sha256", "")).lower() != sha256:
+        raise HTTPException(status_code=422, detail="Bundle is for another sample")
+
+    kinds = list(manifest["files"])
+    reports.save_bundle(sha256, path, kinds)
+    db = SessionLocal()
+    try:
+        for kind in kinds:
+            index_stored_report(db, sha256, kind)
+    finally:
+        db.close()
+    return kinds
 
-#     with open(file_path, "wb") as f:
-#         shutil.copyfileobj(file.file, f)
 
-#     return {"status": "ok", "filename": filename}
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@app.post("/reports/{sha256}/bundle")
+async def upload_report_bundle(sha256: str, request: Request,
+                               x_content_sha256: str = Header(None)):
+    """
+    Stores a report bundle relayed from a VM agent in one request: a
+    tar.gz of reports named by kind plus a manifest of their sha256s. The
+    body is checked against X-Content-SHA256 and every report against the
+    manifest before anything is stored.
+    """
+    sha256 = report_sha256(sha256)
+    fd, path = tempfile.mkstemp(prefix=".bundle-", dir=UPLOAD_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                await run_in_threadpool(f.write, chunk)
+        stored = await run_in_threadpool(store_bundle, sha256, path, x_content_sha256)
+    finally:
+        os.remove(path)
+    return {"status": "success", "stored": stored}
+
+
+# Request bodies up to this size are spooled in memory, bigger ones on disk
+SPOOL_MAX_BYTES = 1024 * 1024
+
+
+def store_report(sha256, kind, body, expected_digest):
+    try:
+        reports.save(sha256, kind, body, expected_digest)
+    except DigestMismatch as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    db = SessionLocal()
+    try:
+        index_stored_report(db, sha256, kind)
+    finally:
+        db.close()
+
+
+@app.put("/reports/{sha256}/{kind}")
+async def put_report(sha256: str, kind: str, request: Request,
+                     x_content_sha256: str = Header(None)):
+    """
+    Stores one report from the raw request body, byte for byte. With
+    X-Content-SHA256 it is only stored if the body matches that digest
+    (422 otherwise), so a corrupted relay never replaces a good copy.
+    """
+    if kind not in REPORT_KINDS:
+        raise HTTPException(status_code=404, detail="Unknown report kind")
+    sha256 = report_sha256(sha256)
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as body:
+        async for chunk in request.stream():
+            await run_in_threadpool(body.write, chunk)
+        body.seek(0)
+        await run_in_threadpool(store_report, sha256, kind, body, x_content_sha256)
+    return {"status": "success", "sha256": sha256, "kind": kind}
+
+
+@app.get("/reports/{sha256}/{kind}")
+def get_report(sha256: str, kind: str, request: Request):
+    """
+    Returns a report (e.g. kind=static.json) as raw bytes.
+    """
+    if kind not in REPORT_KINDS:
+        raise HTTPException(status_code=404, detail="Unknown report kind")
+    return report_response(request, report_sha256(sha256), kind)
 
 
 @app.get("/download/{filename}")
 def download_file(filename: str):
+    filename = os.path.basename(filename)
+    report_key = parse_report_filename(filename)
+    meta = reports.get(*report_key) if report_key else None
+    if meta is not None:
+        return Response(reports.read_decoded(meta), media_type='application/octet-stream',
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
     file_path = os.path.join(UPLOAD_DIR, filename)
     if not os.path.exists(file_path):
         return {"error": "File not found"}
@@ -177,17 +924,31 @@ def download_file(filename: str):
 
 
 @app.get("/json/{filename}")
-def get_file_as_json(filename: str):
+def get_file_as_json(filename: str, request: Request):
+    """
+    Returns a JSON report as-is (no wrapping object, no re-encoding).
+    """
+    filename = os.path.basename(filename)
+    report_key = parse_report_filename(filename)
+    if report_key and reports.get(*report_key) is not None:
+        return report_response(request, *report_key)
+
+    # Reports uploaded before the report store existed
     file_path = os.path.join(UPLOAD_DIR, filename)
     if not os.path.exists(file_path):
-        return {"error": "File not found"}
-    with open(file_path, "r") as f:
-        content = f.read()
-    return {"filename": filename, "content": content}
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileResponse(file_path, media_type='application/json')
 
 
 @app.get("/text/{filename}")
 def get_file_as_text(filename: str):
+    filename = os.path.basename(filename)
+    report_key = parse_report_filename(filename)
+    meta = reports.get(*report_key) if report_key else None
+    if meta is not None:
+        content = reports.read_decoded(meta).decode("utf-8", errors="replace")
+        return {"filename": filename, "content": content}
+
     file_path = os.path.join(UPLOAD_DIR, filename)
     if not os.path.exists(file_path):
         return {"error": "File not found"}
@@ -196,58 +957,105 @@ def get_file_as_text(filename: str):
     return {"filename": filename, "content": content}
 
 
-class ClientsRequest(BaseModel):
-    clients: list[str]  # List of client strings
+@app.get("/samples/{sha256}/findings")
+def read_sample_findings(sha256: str, db: Session = Depends(get_db)):
+    """
+    Returns the verdicts, findings and IOCs indexed from a sample's reports.
+    """
+    sample = db.query(Sample).filter(Sample.hash_sha256 == sha256).first()
+    if sample is None:
+        raise HTTPException(status_code=404, detail="Sample not found")
+    return sample_findings(db, sample.id)
+
+
+@app.get("/iocs/samples")
+def read_samples_with_ioc(kind: str, value: str, limit: int = 100, db: Session = Depends(get_db)):
+    """
+    Returns the samples whose reports contain an IOC, e.g. ?kind=ip&value=1.2.3.4
+    """
+    return samples_with_ioc(db, kind, value, min(limit, MAX_PAGE_SIZE))
 
 
-@app.post("/update_core/")
-async def update_core(request: ClientsRequest):
+@app.get("/findings/top")
+def read_top_findings(since: datetime = None, limit: int = 20, db: Session = Depends(get_db)):
+    """
+    Returns the most matched rules since `since` (default: the last 7 days).
     """
-    Delete 'core', add provided clients to the set, and set expiration to 10 seconds.
+    if since is None:
+        since = datetime.now() - timedelta(days=7)
+    return top_rules(db, since, min(limit, MAX_PAGE_SIZE))
+
+
+@app.get("/cache/stats")
+def get_cache_stats():
     """
-    # if not request.clients:
-    #     raise HTTPException(
-    #         status_code=400, detail="Clients list cannot be empty")
+    Hit/miss counters of the sample metadata and listing caches.
+    """
+    return cache.stats()
+
+
+class WorkerHeartbeat(BaseModel):
+    role: str  # "core" or "host"
+    capacity: int = 0  # analysis slots (VMs for a host)
+    busy: int = 0  # slots currently in use
+    current_samples: list[str] = []  # sha256 of the samples in flight
+    clients: list[str] = []  # hosts connected to a core
+    ttl: int = 15  # seconds without a heartbeat before the worker is gone
 
+
+@app.post("/workers/{worker_id}/heartbeat")
+def worker_heartbeat(worker_id: str, heartbeat: WorkerHeartbeat):
+    """
+    Refreshes a worker's own presence record.
+    """
+    if heartbeat.role not in ("core", "host"):
+        raise HTTPException(status_code=400, detail="role must be core or host")
     try:
-        # Use pipeline for atomic execution
-        pipe = r.pipeline()
-        pipe.delete("core")
+        record = presence.heartbeat(
+            worker_id, heartbeat.model_dump(exclude={"ttl"}), heartbeat.ttl)
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "success", "worker": record}
 
-        if request.clients:
-            pipe.sadd("core", *request.clients)
-        else:
-            pipe.sadd("core", "")  # Add empty string if no clients provided
 
-        pipe.expire("core", 6)
-        pipe.execute()
+@app.delete("/workers/{worker_id}")
+def worker_leave(worker_id: str):
+    """
+    Removes a worker right away (graceful shutdown).
+    """
+    try:
+        presence.leave(worker_id)
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "success"}
 
-        return {
-            "status": "success",
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/workers")
+def get_workers():
+    """
+    Fleet view: every live worker with its capacity, busy slots, current
+    samples and last-seen time, plus totals.
+    """
+    try:
+        fleet = presence.fleet()
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "success", **fleet}
 
 
 @app.get("/core")
 def get_core_clients():
     """
-    Retrieve all clients in the 'core' set.
-    """
-    try:
-        if not r.exists("core"):
-            return {
-                "status": "failed",
-                "clients": []
-            }
-        clients = r.smembers("core")
-        # If the core set doesn't exist, raise a 404 error
-        return {
-            "status": "success",
-            "clients": list(clients)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    Hosts connected to the live cores (kept for older dashboards).
+    """
+    try:
+        cores = [w for w in presence.fleet()["workers"] if w["role"] == "core"]
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if not cores:
+        return {"status": "failed", "clients": []}
+    return {"status": "success",
+            "clients": [client for core in cores for client in core["clients"]]}
 
 
 if __name__ == '__main__':
@@ -0,0 +1,58 @@
+"""
+Bring an existing database up to the current models. create_all() only
+creates missing tables, so this adds the samples columns and indexes that
+came later, and backfills them from the analysis flags. Safe to run more
+than once.
+
+    python migrate.py
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from database import engine, Base
+from models import Sample
+
+# Run once, right after the column is added, so they never overwrite
+# values written by the service
+BACKFILLS = {
+    # Analyzed samples are not work; everything else is queued again
+    "analysis_pending": "UPDATE samples SET analysis_pending = 0 "
+                        "WHERE static_analysis = 1 AND dynamic_analysis = 1",
+    "static_status": "UPDATE samples SET static_status = 'done' WHERE static_analysis = 1",
+    "dynamic_status": "UPDATE samples SET dynamic_status = 'done' WHERE dynamic_analysis = 1",
+    "network_status": "UPDATE samples SET network_status = 'done' "
+                      "WHERE static_analysis = 1 AND dynamic_analysis = 1",
+}
+
+
+def migrate():
+    # New tables (verdicts, findings, iocs)
+    Base.metadata.create_all(bind=engine)
+
+    existing = {column["name"] for column in inspect(engine).get_columns("samples")}
+    added = []
+    with engine.begin() as conn:
+        for column in Sample.__table__.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            print(f"[+] samples.{column.name}")
+            conn.execute(text(f"ALTER TABLE samples ADD COLUMN {ddl}"))
+            added.append(column.name)
+
+        for name in added:
+            if name in BACKFILLS:
+                result = conn.execute(text(BACKFILLS[name]))
+                print(f"[+] Backfilled samples.{name} on {result.rowcount} row(s)")
+
+    indexes = {index["name"] for index in inspect(engine).get_indexes("samples")}
+    for index in Sample.__table__.indexes:
+        if index.name not in indexes:
+            print(f"[+] Index {index.name}")
+            index.create(bind=engine)
+
+    print("[*] Database is up to date")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Index, ForeignKey, UniqueConstraint, text
 from database import Base
 from datetime import datetime
 from sqlalchemy.types import DateTime
@@ -7,6 +7,8 @@ from sqlalchemy.types import Boolean
 
 class Sample(Base):
     __tablename__ = "samples"
+    # Columns added after the first release carry a server_default so
+    # migrate.py can add them to an existing table
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     hash_md5 = Column(String(32), unique=True, nullable=False)
@@ -15,6 +17,101 @@ class Sample(Base):
     file_name = Column(String(255), nullable=False)
     file_size = Column(Integer)
     file_type = Column(String(100))
-    upload_date = Column(DateTime, default=datetime.now())
+    upload_date = Column(DateTime, default=datetime.now)
     static_analysis = Column(Boolean, default=False)
     dynamic_analysis = Column(Boolean, default=False)
+    # Per-stage progress reported by the VM as each stage ends: queued,
+    # running, done or failed; static results show up before dynamic ends
+    static_status = Column(String(16), default="queued", server_default="queued", nullable=False)
+    dynamic_status = Column(String(16), default="queued", server_default="queued", nullable=False)
+    network_status = Column(String(16), default="queued", server_default="queued", nullable=False)
+
+    # Work queue state: a sample stays pending until both analyses are done,
+    # and a claim holds it for one worker until lease_expires
+    analysis_pending = Column(Boolean, default=True, server_default=text("1"), nullable=False)
+    claimed_by = Column(String(64))
+    lease_expires = Column(DateTime)
+    claimed_at = Column(DateTime)
+    # Every claim is an attempt; a sample that keeps failing (crashes its
+    # host, never reports back) is quarantined instead of retried forever
+    attempts = Column(Integer, default=0, server_default=text("0"), nullable=False)
+    quarantined = Column(Boolean, default=False, server_default=text("0"), nullable=False)
+    last_error = Column(String(255))
+
+    # Scheduling: higher priority first, fair share between submitters,
+    # and a lane ("small" / "normal") so quick samples are not stuck
+    # behind big ones
+    priority = Column(Integer, default=0, server_default=text("0"), nullable=False)
+    submitter = Column(String(64))
+    lane = Column(String(16), default="normal", server_default="normal", nullable=False)
+
+    # Keyset pagination indexes for the sample listing, newest first
+    __table_args__ = (
+        Index("ix_samples_upload_date_id", "upload_date", "id"),
+        Index("ix_samples_file_type_upload_date_id",
+              "file_type", "upload_date", "id"),
+        Index("ix_samples_status_upload_date_id",
+              "analysis_pending", "upload_date", "id"),
+        # Claim queue; partial where the backend supports it (MariaDB
+        # ignores the WHERE and keeps the leading pending flag instead)
+        Index("ix_samples_pending_queue",
+              "analysis_pending", "lease_expires", "id",
+              postgresql_where=text("analysis_pending"),
+              sqlite_where=text("analysis_pending = 1")),
+        # Heads of the per submitter / priority / lane scheduling groups
+        Index("ix_samples_pending_schedule",
+              "analysis_pending", "submitter", "priority", "lane", "id"),
+    )
+
+
+# Normalized analysis results, filled in when a JSON report is ingested so
+# cross-sample questions are indexed queries instead of report scans
+
+class Verdict(Base):
+    __tablename__ = "verdicts"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sample_id = Column(Integer, ForeignKey("samples.id"), nullable=False)
+    source = Column(String(16), nullable=False)  # static / dynamic / network
+    verdict = Column(String(32))  # static verdict or dynamic risk level
+    score = Column(Integer)
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint("sample_id", "source", name="uq_verdicts_sample_source"),
+        Index("ix_verdicts_verdict_created_at", "verdict", "created_at"),
+    )
+
+
+class Finding(Base):
+    __tablename__ = "findings"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sample_id = Column(Integer, ForeignKey("samples.id"), nullable=False)
+    source = Column(String(16), nullable=False)
+    rule = Column(String(255), nullable=False)
+    weight = Column(Integer)
+    value = Column(String(1024))
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_findings_sample_id", "sample_id"),
+        Index("ix_findings_created_at_rule", "created_at", "rule"),
+    )
+
+
+class Ioc(Base):
+    __tablename__ = "iocs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sample_id = Column(Integer, ForeignKey("samples.id"), nullable=False)
+    source = Column(String(16), nullable=False)
+    kind = Column(String(16), nullable=False)  # ip / url / api
+    value = Column(String(512), nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint("sample_id", "source", "kind", "value",
+                         name="uq_iocs_sample_source_kind_value"),
+        Index("ix_iocs_kind_value", "kind", "value"),
+    )
@@ -0,0 +1,64 @@
+import json
+import time
+
+WORKERS_KEY = "workers"  # set of registered worker ids
+WORKER_KEY = "worker:{}"  # per-worker presence record, expires with its TTL
+
+# Reads every live presence record in one Redis call and forgets workers
+# whose key has expired
+FLEET_SCRIPT = """
+local ids = redis.call('SMEMBERS', KEYS[1])
+local records = {}
+for _, id in ipairs(ids) do
+    local record = redis.call('GET', 'worker:' .. id)
+    if record then
+        table.insert(records, record)
+    else
+        redis.call('SREM', KEYS[1], id)
+    end
+end
+return records
+"""
+
+
+class PresenceRegistry:
+    """
+    Presence of core and host workers. Each worker refreshes its own
+    worker:<id> key on every heartbeat; a worker that stops heartbeating
+    disappears when the key's TTL runs out.
+    """
+
+    def __init__(self, client):
+        self.r = client
+        self._fleet = client.register_script(FLEET_SCRIPT)
+
+    def heartbeat(self, worker_id, record, ttl):
+        record = dict(record, worker_id=worker_id, last_seen=time.time())
+        pipe = self.r.pipeline()
+        pipe.setex(WORKER_KEY.format(worker_id), ttl, json.dumps(record))
+        pipe.sadd(WORKERS_KEY, worker_id)
+        pipe.execute()
+        return record
+
+    def leave(self, worker_id):
+        pipe = self.r.pipeline()
+        pipe.delete(WORKER_KEY.format(worker_id))
+        pipe.srem(WORKERS_KEY, worker_id)
+        pipe.execute()
+
+    def fleet(self):
+        """All live workers plus fleet-wide totals."""
+        workers = sorted((json.loads(record) for record in self._fleet(keys=[WORKERS_KEY])),
+                         key=lambda w: w["worker_id"])
+        totals = {"cores": 0, "hosts": 0, "capacity": 0, "busy": 0, "clients": 0}
+        for worker in workers:
+            if worker.get("role") == "core":
+                totals["cores"] += 1
+                totals["clients"] += len(worker.get("clients", []))
+            else:
+                # Analysis slots live on hosts; a core's numbers mirror its hosts
+                totals["hosts"] += 1
+                totals["capacity"] += worker.get("capacity", 0)
+                totals["busy"] += worker.get("busy", 0)
+        totals["free"] = max(totals["capacity"] - totals["busy"], 0)
+        return {"workers": workers, "totals": totals}
@@ -0,0 +1,190 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import tarfile
+import uuid
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+
+# Report kinds produced by the VM agent, keyed as "<stage>.<ext>"
+REPORT_KINDS = ("static.json", "static.txt", "dynamic.json",
+                "dynamic.txt", "network.json", "network.txt")
+
+MEDIA_TYPES = {"json": "application/json",
+               "txt": "text/plain; charset=utf-8"}
+
+# Reports are stored under the sha256 of their sample
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Legacy flat report names: <sha256>_<stage>.<ext>
+REPORT_FILENAME_RE = re.compile(
+    r"^([0-9a-f]{64})_(static|dynamic|network)\.(json|txt)$")
+
+
+# Report bundles from the VM agent: a tar.gz of reports named by kind plus
+# this manifest, {"sha256": ..., "files": {kind: {"sha256", "size"}}}
+BUNDLE_MANIFEST = "manifest.json"
+
+
+class DigestMismatch(ValueError):
+    """A report whose bytes do not match the sha256 it was sent with."""
+
+
+class BundleError(ValueError):
+    """A report bundle that is unreadable or does not match its manifest."""
+
+
+def verify_bundle(path):
+    """Check every report of a bundle against its manifest. Returns the manifest."""
+    try:
+        with tarfile.open(path, "r:gz") as tar:
+            try:
+                manifest = json.load(tar.extractfile(BUNDLE_MANIFEST))
+                files = dict(manifest["files"])
+            except (KeyError, TypeError, ValueError):
+                raise BundleError("Missing or invalid manifest")
+
+            for kind, expected in files.items():
+                if kind not in REPORT_KINDS:
+                    raise BundleError(f"Unknown report kind: {kind}")
+                try:
+                    member = tar.extractfile(kind)
+                except KeyError:
+                    raise BundleError(f"{kind} is in the manifest but not in the bundle")
+                digest = hashlib.sha256()
+                size = 0
+                for chunk in iter(lambda: member.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    size += len(chunk)
+                if digest.hexdigest() != expected.get("sha256") or size != expected.get("size"):
+                    raise BundleError(f"{kind} does not match the manifest")
+    except (tarfile.TarError, EOFError, OSError) as e:
+        raise BundleError(f"Unreadable bundle: {e}")
+    return manifest
+
+
+def parse_report_filename(filename):
+    """Map "<sha256>_static.json" to ("<sha256>", "static.json"), or None."""
+    match = REPORT_FILENAME_RE.match(os.path.basename(filename).lower())
+    if not match:
+        return None
+    sha256, stage, ext = match.groups()
+    return sha256, f"{stage}.{ext}"
+
+
+class ReportStore:
+    """
+    Analysis reports keyed by (sha256, kind), compressed at rest.
+
+    Layout: <root>/<sha[0:2]>/<sha[2:4]>/<sha256>/<kind>.<gz|zst> plus a
+    <kind>.meta JSON sidecar holding the encoding, the sizes and the sha256
+    of the uncompressed bytes (used as the ETag).
+    """
+
+    def __init__(self, root, codec="gzip"):
+        if codec == "zstd" and zstandard is None:
+            print("zstandard not installed, storing reports with gzip")
+            codec = "gzip"
+        self.root = root
+        self.codec = codec
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, sha256):
+        # Never let a path parameter escape the store root
+        if not SHA256_RE.match(sha256):
+            raise ValueError(f"Not a sha256: {sha256!r}")
+        return os.path.join(self.root, sha256[0:2], sha256[2:4], sha256)
+
+    def _meta_path(self, sha256, kind):
+        return os.path.join(self._dir(sha256), f"{kind}.meta")
+
+    def save(self, sha256, kind, fileobj, expected_sha256=None):
+        """
+        Compress a report from a file-like object into the store. Returns
+        its meta. With expected_sha256 the report is only stored if its
+        bytes match; DigestMismatch otherwise, leaving any previous copy.
+        """
+        if kind not in REPORT_KINDS:
+            raise ValueError(f"Unknown report kind: {kind}")
+
+        directory = self._dir(sha256)
+        os.makedirs(directory, exist_ok=True)
+
+        ext = "zst" if self.codec == "zstd" else "gz"
+        data_path = os.path.join(directory, f"{kind}.{ext}")
+        tmp_path = os.path.join(directory, f".{uuid.uuid4().hex}.part")
+
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as raw:
+                if self.codec == "zstd":
+                    writer = zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+                else:
+                    writer = gzip.GzipFile(fileobj=raw, mode="wb", mtime=0)
+                with writer:
+                    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        writer.write(chunk)
+            if expected_sha256 and digest.hexdigest() != expected_sha256.lower():
+                raise DigestMismatch(
+                    f"{kind} has sha256 {digest.hexdigest()}, expected {expected_sha256}")
+            os.replace(tmp_path, data_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        meta = {
+            "sha256": sha256,
+            "kind": kind,
+            "encoding": self.codec,
+            "path": data_path,
+            "size": size,
+            "stored_size": os.path.getsize(data_path),
+            "etag": digest.hexdigest(),
+            "media_type": MEDIA_TYPES[kind.rsplit(".", 1)[1]],
+        }
+        meta_tmp = f"{tmp_path}.meta"
+        with open(meta_tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_tmp, self._meta_path(sha256, kind))
+        return meta
+
+    def save_bundle(self, sha256, path, kinds):
+        """Store the given reports of a verified bundle. Returns their metas."""
+        with tarfile.open(path, "r:gz") as tar:
+            return [self.save(sha256, kind, tar.extractfile(kind)) for kind in kinds]
+
+    def get(self, sha256, kind):
+        """Return the meta of a stored report, or None."""
+        try:
+            with open(self._meta_path(sha256, kind)) as f:
+                return json.load(f)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def read_encoded(self, meta, start=0, end=None):
+        """Read the compressed bytes as stored, optionally a [start, end] slice."""
+        with open(meta["path"], "rb") as f:
+            f.seek(start)
+            length = None if end is None else end - start + 1
+            return f.read() if length is None else f.read(length)
+
+    def open_decoded(self, meta):
+        """Open the uncompressed report as a binary file object."""
+        if meta["encoding"] == "zstd":
+            return zstandard.ZstdDecompressor().stream_reader(open(meta["path"], "rb"), closefd=True)
+        return gzip.open(meta["path"], "rb")
+
+    def read_decoded(self, meta):
+        with self.open_decoded(meta) as f:
+            return f.read()
@@ -0,0 +1,116 @@
+import os
+from datetime import datetime
+
+from sqlalchemy import func
+
+from models import Sample
+
+# Priorities run from 0 (background) to 9 (urgent)
+MIN_PRIORITY = 0
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = 0
+
+# Every AGING_SECONDS a sample waits counts as one extra priority level,
+# so old low-priority work eventually overtakes fresh high-priority work
+AGING_SECONDS = int(os.getenv("SCHEDULING_AGING_SECONDS", "600"))
+
+# Lanes: small files finish quickly (mostly static work), so they get a
+# head start of SMALL_LANE_BOOST priority levels
+SMALL_FILE_BYTES = int(os.getenv("SMALL_FILE_BYTES", str(1024 * 1024)))
+SMALL_LANE_BOOST = int(os.getenv("SMALL_LANE_BOOST", "2"))
+LANES = ("small", "normal")
+
+DEFAULT_POLICY = os.getenv("SCHEDULING_POLICY", "fair_share")
+
+
+def lane_for(file_size):
+    return "small" if file_size is not None and file_size <= SMALL_FILE_BYTES else "normal"
+
+
+def score(priority, lane, upload_date, now):
+    """Effective priority of a waiting sample: base + lane boost + aging."""
+    waited = max((now - upload_date).total_seconds(), 0) if upload_date else 0
+    boost = SMALL_LANE_BOOST if lane == "small" else 0
+    return (priority or 0) + boost + waited / AGING_SECONDS
+
+
+def _candidates(db, claimable, count, lane, by_submitter):
+    """
+    The best `count` candidates of every (priority, lane[, submitter]) group.
+
+    Within a group all samples share the same base score, so the oldest are
+    always the best ones; the winners overall are among these heads. One
+    query, no row locks: claim_samples() takes each winner with a
+    conditional UPDATE, so only the chosen rows are ever locked. The
+    window still ranks every claimable row, i.e. the whole pending queue.
+    """
+    group = [Sample.priority, Sample.lane]
+    if by_submitter:
+        group.append(Sample.submitter)
+
+    rank = func.row_number().over(partition_by=group, order_by=Sample.id.asc())
+    ranked = db.query(Sample.id, Sample.priority, Sample.lane, Sample.submitter,
+                      Sample.upload_date, rank.label("rank")).filter(claimable)
+    if lane:
+        ranked = ranked.filter(Sample.lane == lane)
+    ranked = ranked.subquery()
+    return db.query(ranked.c.id, ranked.c.priority, ranked.c.lane, ranked.c.submitter,
+                    ranked.c.upload_date).filter(ranked.c.rank <= count).all()
+
+
+def fifo(db, claimable, count, lane=None):
+    """Oldest first."""
+    query = db.query(Sample.id).filter(claimable)
+    if lane:
+        query = query.filter(Sample.lane == lane)
+    return [sample_id for (sample_id,) in
+            query.order_by(Sample.id.asc()).limit(count)
+            .with_for_update(skip_locked=True).all()]
+
+
+def priority(db, claimable, count, lane=None):
+    """Highest effective priority first (base priority, lane boost, aging)."""
+    now = datetime.now()
+    rows = _candidates(db, claimable, count, lane, by_submitter=False)
+    rows.sort(key=lambda row: (-score(row.priority, row.lane, row.upload_date, now), row.id))
+    return [row.id for row in rows[:count]]
+
+
+def fair_share(db, claimable, count, lane=None):
+    """
+    Share the workers between submitters: each pick goes to the submitter
+    with the fewest samples currently under analysis, and within a
+    submitter the sample with the highest effective priority wins.
+    """
+    now = datetime.now()
+    queues = {}
+    for row in _candidates(db, claimable, count, lane, by_submitter=True):
+        queues.setdefault(row.submitter, []).append(row)
+    for rows in queues.values():
+        rows.sort(key=lambda row: (-score(row.priority, row.lane, row.upload_date, now), row.id))
+
+    # Samples each submitter already has out for analysis
+    running = dict(db.query(Sample.submitter, func.count(Sample.id))
+                   .filter(Sample.analysis_pending == True,
+                           Sample.lease_expires >= now)
+                   .group_by(Sample.submitter).all())
+
+    picked = []
+    while queues and len(picked) < count:
+        submitter = min(queues, key=lambda s: (
+            running.get(s, 0),
+            -score(queues[s][0].priority, queues[s][0].lane, queues[s][0].upload_date, now),
+            queues[s][0].id))
+        picked.append(queues[submitter].pop(0).id)
+        running[submitter] = running.get(submitter, 0) + 1
+        if not queues[submitter]:
+            del queues[submitter]
+    return picked
+
+
+# Scheduling policies: (db, claimable filter, count, lane) → sample ids in claim order
+POLICIES = {
+    "fifo": fifo,
+    "priority": priority,
+    "fair_share": fair_share,
+}
@@ -1,14 +1,17 @@
 import os
 import argparse
-import requests
+import asyncio
+import aiohttp
+from aiohttp import web
 import socketio
 from dataclasses import dataclass
-import time
-import io
 import json
 import hashlib
+import socket
+import time
 from dotenv import load_dotenv # New Import
 from vm_manager import VM
+from vm_pool import VMPool
 
 # Load variables from .env
 load_dotenv()
@@ -21,29 +24,33 @@ vmx_paths_raw = os.getenv("VMX_PATHS", "")
 vmx_paths = [path.strip() for path in vmx_paths_raw.split(",") if path.strip()]
 
 ISO_PATH = os.getenv("VM_AGENT_ISO_PATH")
+# Clean snapshot every VM is reverted to after each job (and on start),
+# so no sample runs on a VM another one has touched
+CLEAN_SNAPSHOT = os.getenv("CLEAN_SNAPSHOT")
+# Port of the pool status endpoint (GET /pool)
+HOST_STATUS_PORT = int(os.getenv("HOST_STATUS_PORT", "5004"))
+
+# Stable id of this host: after a reconnect, to any core, the host keeps
+# the samples it was analyzing
+HOST_ID = os.getenv("HOST_ID", socket.gethostname())
+
+# Presence heartbeat to Data Access (GET /workers): sent every interval,
+# record expires after ttl
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TTL = 15
 
 # Create a list of VM objects
 vms = [VM(path, guest_user, guest_pass) for path in vmx_paths]
 
 print(f"[*] Initialized {len(vms)} Virtual Machines.")
 
-def run_on_all_vms(method_name, *args, **kwargs):
-    """Helper to run a VM method on all initialized virtual machines."""
-    for i, vm in enumerate(vms):
-        try:
-            method = getattr(vm, method_name)
-            print(f"[#] Executing {method_name} on VM {i+1}...")
-            method(*args, **kwargs)
-        except Exception as e:
-            print(f"[!] Failed on VM {i+1} ({vm.vmx_path}): {e}")
-
-
 @dataclass(frozen=True)
 class Services:
     # Pull from .env with fallbacks if needed
     CORE: str = os.getenv("CORE_URL")
     DATA_ACCESS: str = os.getenv("DATA_ACCESS_URL")
-    VM_AGENT: str = os.getenv("VM_AGENT_URL")
+    # One VM agent URL per VM, comma separated in VMX_PATHS order
+    VM_AGENT: str = os.getenv("VM_AGENT_URLS", os.getenv("VM_AGENT_URL"))
 
 @dataclass(frozen=True)
 class Endpoints:
@@ -51,6 +58,10 @@ class Endpoints:
     VM_UPLOAD: str = "/upload"
     JSON: str = "/json/"
     REPORT: str = "/report/"
+    JOBS: str = "/jobs/"
+    REPORTS: str = "/reports/"
+    UPLOAD: str = "/upload"
+    WORKERS: str = "/workers/"
 
 def parse_args():
     # We initialize temporary services to get defaults for help text
@@ -61,7 +72,7 @@ def parse_args():
     parser.add_argument(
         "--data-access-url", default=defaults.DATA_ACCESS, help="Data access service URL")
     parser.add_argument(
-        "--vm-agent-url", default=defaults.VM_AGENT, help="VM agent service URL")
+        "--vm-agent-url", default=defaults.VM_AGENT, help="VM agent service URL(s), comma separated, one per VM")
     return parser.parse_args()
 
 def build_services():
@@ -74,113 +85,479 @@ def build_services():
 
 services = build_services()
 DATA_ACCESS_URL = f"{services.DATA_ACCESS}{Endpoints.SAMPLES}"
-VM_AGENT_UPLOAD_URL = f"{services.VM_AGENT}{Endpoints.VM_UPLOAD}"
-
-sio = socketio.Client()
+vm_agent_urls = [url.strip() for url in (services.VM_AGENT or "").split(",") if url.strip()]
+
+# Outbound HTTP: one pooled keep-alive session; reads may take as long as a detonation
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=10, sock_read=300)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_KEEPALIVE = 30
+
+# Reports are relayed in chunks of this size, never held whole in memory
+RELAY_CHUNK_SIZE = 64 * 1024
+
+# Report relay: artifacts in flight at once (all VMs together), tries per
+# artifact, and the first retry delay (doubled on each further retry)
+REPORT_CONCURRENCY = int(os.getenv("REPORT_CONCURRENCY", "6"))
+REPORT_ATTEMPTS = int(os.getenv("REPORT_ATTEMPTS", "3"))
+REPORT_RETRY_DELAY = 0.5
+REPORT_TIMEOUT = aiohttp.ClientTimeout(total=30)
+
+# Analysis stages, reported by the VM agent as each one ends
+STAGES = ("static", "dynamic", "network")
+# VM agent job states after which nothing changes any more
+JOB_FINAL_STATES = ("done", "failed")
+
+sio = socketio.AsyncClient()
+http_session = None
+# The VMs of this host and their states, see vm_pool.py
+pool = None
+# Bounds the report transfers in flight, see REPORT_CONCURRENCY
+report_slots = None
+# Set once Data Access turns out to lack PUT /reports/{sha256}/{kind};
+# reports then go through its multipart /upload instead
+legacy_report_upload = False
+# Running analyses by sha256, so Core can cancel them; also keeps strong
+# references, asyncio only keeps weak ones
+analyses = {}
 
-# ... [Keep your calculate_sha256_bytes and sio events exactly the same] ...
-
-def calculate_sha256_bytes(data_bytes: bytes) -> str:
-    sha256_hash = hashlib.sha256()
-    sha256_hash.update(data_bytes)
-    return sha256_hash.hexdigest()
 
 @sio.event
-def connect():
+async def connect():
     print("Connected to Core server!")
-
-@sio.event
-def file_sha256(data):
-    print(f"\n[+] Processing file: {data}\n")
-    # --- Step 1: Download ZIP from Data Access and upload to VM Agent ---
+    # One sample at a time per usable VM; core keeps track of how many are
+    # free, and a booting, reverting or faulted VM takes none
+    await sio.emit("register", {"host_id": HOST_ID, "slots": pool.usable()})
+
+async def advertise_slots(pool):
+    # Capacity changes only; a register would renew this host's assignments
+    if sio.connected:
+        await sio.emit("capacity", {"slots": pool.usable()})
+
+class HashingStream:
+    """Pass a response body through in chunks, hashing it on the way."""
+
+    def __init__(self, response):
+        self.response = response
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    async def chunks(self):
+        async for chunk in self.response.content.iter_chunked(RELAY_CHUNK_SIZE):
+            self.digest.update(chunk)
+            self.size += len(chunk)
+            yield chunk
+
+async def relay_once(vm_agent, sha256, kind, timings):
+    """
+    Stream one report from a VM agent into Data Access byte for byte.
+    The bytes are hashed on the fly and Data Access checks them against
+    the VM's digest before storing, so memory and CPU stay constant
+    whatever the report size.
+    """
+    filename = f"{sha256}_{kind}"
+    started = time.monotonic()
+    async with http_session.get(f"{vm_agent}{Endpoints.REPORT}{filename}",
+                                timeout=REPORT_TIMEOUT) as r:
+        if r.status == 404:
+            print(f"[*] {filename} was not produced by the VM, nothing to relay")
+            return
+        r.raise_for_status()
+        fetched = time.monotonic()
+        timings["report_fetch"] += fetched - started
+
+        vm_hash = r.headers.get("X-Content-SHA256") or r.headers.get("X-File-Hash")
+        headers = {"Content-Type": "application/octet-stream"}
+        if vm_hash:
+            headers["X-Content-SHA256"] = vm_hash
+        body = HashingStream(r)
+        async with http_session.put(f"{services.DATA_ACCESS}{Endpoints.REPORTS}{sha256}/{kind}",
+                                    data=body.chunks(), headers=headers,
+                                    timeout=REPORT_TIMEOUT) as upload_response:
+            if upload_response.status == 422:
+                print(f"[!] Hash mismatch for {filename}: VM={vm_hash}, "
+                      f"relayed={body.digest.hexdigest()}")
+            upload_response.raise_for_status()
+    timings["report_upload"] += time.monotonic() - fetched
+
+    print(f"[+] {filename} ({body.size} bytes) uploaded successfully to Data Access.")
+
+async def retrying(call):
+    """
+    Await call() under report_slots, retrying connection errors, timeouts,
+    5xx answers and integrity failures (422) with a doubling delay. Raises
+    the last error.
+    """
+    for attempt in range(1, REPORT_ATTEMPTS + 1):
+        try:
+            async with report_slots:
+                return await call()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            permanent = (isinstance(e, aiohttp.ClientResponseError)
+                         and e.status < 500 and e.status != 422)
+            if permanent or attempt == REPORT_ATTEMPTS:
+                raise
+            print(f"[!] Retrying ({attempt}/{REPORT_ATTEMPTS}): {e}")
+            await asyncio.sleep(REPORT_RETRY_DELAY * 2 ** (attempt - 1))
+
+async def upload_once(vm_agent, sha256, kind, timings):
+    """
+    Relay one report through Data Access's multipart /upload, for services
+    without PUT /reports. The report is checked against the VM's digest
+    before it is sent, since /upload does not check it.
+    """
+    filename = f"{sha256}_{kind}"
+    started = time.monotonic()
+    async with http_session.get(f"{vm_agent}{Endpoints.REPORT}{filename}",
+                                timeout=REPORT_TIMEOUT) as r:
+        if r.status == 404:
+            print(f"[*] {filename} was not produced by the VM, nothing to relay")
+            return
+        r.raise_for_status()
+        content = await r.read()
+        vm_hash = r.headers.get("X-Content-SHA256") or r.headers.get("X-File-Hash")
+    fetched = time.monotonic()
+    timings["report_fetch"] += fetched - started
+
+    if vm_hash and hashlib.sha256(content).hexdigest() != vm_hash:
+        # Retried like any other transfer error
+        raise aiohttp.ClientPayloadError(f"{filename} does not match the VM's digest")
+
+    form = aiohttp.FormData()
+    form.add_field("file", content, filename=filename,
+                   content_type="application/octet-stream")
+    async with http_session.post(f"{services.DATA_ACCESS}{Endpoints.UPLOAD}", data=form,
+                                 timeout=REPORT_TIMEOUT) as upload_response:
+        upload_response.raise_for_status()
+    timings["report_upload"] += time.monotonic() - fetched
+
+    print(f"[+] {filename} ({len(content)} bytes) uploaded successfully to Data Access.")
+
+async def relay_report(vm_agent, sha256, kind, timings):
+    """Relay one report. Returns False if it could not be relayed."""
+    global legacy_report_upload
+    try:
+        if not legacy_report_upload:
+            try:
+                await retrying(lambda: relay_once(vm_agent, sha256, kind, timings))
+                return True
+            except aiohttp.ClientResponseError as e:
+                # Only Data Access answers these: the VM's 404 means no report
+                if e.status not in (404, 405):
+                    raise
+                print(f"[!] Data Access has no PUT {Endpoints.REPORTS}, "
+                      f"falling back to {Endpoints.UPLOAD}")
+                legacy_report_upload = True
+        await retrying(lambda: upload_once(vm_agent, sha256, kind, timings))
+        return True
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"[-] Failed to fetch or upload {sha256}_{kind}: {e}")
+        return False
+
+async def relay_reports(vm_agent, sha256, stages, timings):
+    """
+    Relay the JSON and TXT reports of the given stages one by one, all at
+    once. Returns False if any of them could not be relayed.
+    """
+    started = time.monotonic()
+    relayed = await asyncio.gather(*(relay_report(vm_agent, sha256, f"{stage}{ext}", timings)
+                                     for stage in stages for ext in (".json", ".txt")))
+    timings["reports"] += time.monotonic() - started
+    return all(relayed)
+
+async def relay_bundle_once(vm_agent, sha256, stages, timings):
+    """Stream a VM agent's report bundle straight into Data Access."""
+    started = time.monotonic()
+    async with http_session.get(f"{vm_agent}{Endpoints.JOBS}{sha256}/bundle",
+                                params={"stages": ",".join(stages)},
+                                timeout=REPORT_TIMEOUT) as r:
+        r.raise_for_status()
+        fetched = time.monotonic()
+        timings["report_fetch"] += fetched - started
+
+        vm_hash = r.headers.get("X-Content-SHA256")
+        headers = {"Content-Type": "application/gzip"}
+        if vm_hash:
+            headers["X-Content-SHA256"] = vm_hash
+        body = HashingStream(r)
+        async with http_session.post(f"{services.DATA_ACCESS}{Endpoints.REPORTS}{sha256}/bundle",
+                                     data=body.chunks(),
+                                     headers=headers, timeout=REPORT_TIMEOUT) as upload_response:
+            if upload_response.status == 422:
+                print(f"[!] Bundle of {sha256} rejected: VM={vm_hash}, "
+                      f"relayed={body.digest.hexdigest()}")
+            upload_response.raise_for_status()
+            stored = (await upload_response.json()).get("stored", [])
+    timings["report_upload"] += time.monotonic() - fetched
+
+    print(f"[+] {sha256} bundle ({', '.join(stored)}) uploaded successfully to Data Access.")
+
+async def relay_stages(vm_agent, sha256, stages, timings):
+    """
+    Relay the reports of the given stages as one bundle: a single streamed
+    request and integrity check. Falls back to one request per report for
+    VM agents or Data Access services without bundles. Returns False if
+    the reports could not be relayed.
+    """
+    started = time.monotonic()
+    try:
+        await retrying(lambda: relay_bundle_once(vm_agent, sha256, stages, timings))
+        timings["reports"] += time.monotonic() - started
+        return True
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"[!] Bundle relay of {sha256} failed ({e}), relaying reports one by one")
+        return await relay_reports(vm_agent, sha256, stages, timings)
+
+async def follow_job(vm_agent, job_id):
+    """
+    Yield a VM agent job every time it changes, until it is done or
+    failed. Changes are pushed over /jobs/{id}/events; if that stream
+    drops, the job is long-polled through /jobs/{id}/wait instead.
+    """
+    version = 0
     try:
-        with requests.get(
-            DATA_ACCESS_URL + data,
-            params={"download": 1},
-            stream=True,
-            timeout=60
-        ) as r:
+        async with http_session.get(f"{vm_agent}{Endpoints.JOBS}{job_id}/events") as r:
+            r.raise_for_status()
+            async for line in r.content:
+                job = json.loads(line)
+                if job["version"] > version:
+                    version = job["version"]
+                    yield job
+                if job["state"] in JOB_FINAL_STATES:
+                    return
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        print(f"[!] Job stream of {job_id} dropped ({e}), long-polling instead")
+
+    while True:
+        async with http_session.get(f"{vm_agent}{Endpoints.JOBS}{job_id}/wait",
+                                    params={"version": version, "timeout": 30}) as r:
+            r.raise_for_status()
+            job = await r.json()
+        if job["version"] > version:
+            version = job["version"]
+            yield job
+        if job["state"] in JOB_FINAL_STATES:
+            return
+
+def new_timings():
+    """
+    Where the turnaround of one sample goes, in seconds: zip transfer to
+    the VM, the VM job itself, report fetch and upload (summed over the
+    artifacts, which overlap), and the wait for reports after the VM is
+    done, i.e. transfer overhead on top of the analysis.
+    """
+    return dict.fromkeys(("upload", "vm", "report_fetch", "report_upload",
+                          "reports", "report_wait", "total"), 0.0)
+
+async def publish_stages(vm_agent, data, stages, timings):
+    """
+    Relay the reports of stages that are done, then tell Core. A stage
+    whose reports did not make it is not reported done. Returns False then.
+    """
+    if not await relay_stages(vm_agent, data, stages, timings):
+        print(f"[-] Reports of {data} ({', '.join(stages)}) were not relayed")
+        return False
+    for stage in stages:
+        await sio.emit("stage_update", {"sha256": data, "stage": stage, "status": "done"})
+    return True
+
+async def analyze(vm_agent, data):
+    """
+    Run one sample through one VM, reporting each stage to Core. Returns
+    the final event for Core, file_processed or file_failed, and its data.
+    """
+    timings = new_timings()
+    started = time.monotonic()
+    # Progress events keep Core's assignment of this sample alive
+    await sio.emit("analysis_progress", {"sha256": data, "stage": "uploading"})
+    statuses = {}
+    relays = []
+    job = {}
+    try:
+        # --- Download ZIP from Data Access and upload it to the VM Agent ---
+        async with http_session.get(DATA_ACCESS_URL + data, params={"download": 1}) as r:
             r.raise_for_status()
-
-            def stream():
-                for chunk in r.iter_content(chunk_size=1024*1024):
-                    if chunk:
-                        yield chunk
 
             headers = {"Content-Type": "application/zip",
                        "X-Filename": f"{data}.zip"}
 
-            response = requests.post(
-                VM_AGENT_UPLOAD_URL,
-                data=stream(),
-                headers=headers,
-                timeout=300
-            )
-            response.raise_for_status()
-            print(f"[+] Uploaded {data}.zip to VM Agent: {response.status_code}")
-
-    except requests.exceptions.RequestException as e:
-        print(f"[-] Failed to send ZIP to VM Agent: {e}")
-        return
-
-    sio.emit("file_sent_to_vm_agent", {"filename": data, "status": response.status_code})
-
-    time.sleep(10)
-
-    # --- Step 2: Fetch JSON and TXT reports ---
-    file_types = ["_static", "_dynamic", "_network"]
-    json_ext = ".json"
-    txt_ext = ".txt"
-
-    for ft in file_types:
-        for ext in [json_ext, txt_ext]:
-            filename = f"{data}{ft}{ext}"
-            endpoint = Endpoints.JSON if ext == ".json" else Endpoints.REPORT
-            url = f"{services.VM_AGENT}{endpoint}{filename}"
-
-            try:
-                r = requests.get(url, timeout=30)
-                r.raise_for_status()
-
-                if ext == ".json":
-                    vm_response = r.json()
-                    file_content_bytes = json.dumps(
-                        vm_response.get("data")).encode("utf-8")
-                    vm_hash = vm_response.get("hash")
-                else:
-                    file_content_bytes = r.content
-                    vm_hash = r.headers.get("X-File-Hash")
-
-                computed_hash = calculate_sha256_bytes(file_content_bytes)
-                if vm_hash and computed_hash != vm_hash:
-                    print(f"[!] Hash mismatch for {filename}: VM={vm_hash}, Computed={computed_hash}")
-                    continue 
-
-                files = {"file": (filename, io.BytesIO(file_content_bytes), "application/octet-stream")}
-                upload_response = requests.post(
-                    f"{services.DATA_ACCESS}/upload", files=files, timeout=30)
-                upload_response.raise_for_status()
+            async with http_session.post(
+                f"{vm_agent}{Endpoints.VM_UPLOAD}",
+                data=r.content.iter_chunked(1024*1024),
+                headers=headers
+            ) as response:
+                response.raise_for_status()
+                job = await response.json()
+                print(f"[+] Uploaded {data}.zip to VM Agent {vm_agent}: {response.status}")
+        timings["upload"] = time.monotonic() - started
+
+        await sio.emit("file_sent_to_vm_agent", {"filename": data, "status": response.status})
+
+        # --- Follow the job; publish each stage's reports the moment it
+        # is done, so static results do not wait for the detonation ---
+        if "job_id" in job:
+            async for job in follow_job(vm_agent, job["job_id"]):
+                await sio.emit("analysis_progress", {"sha256": data, "stage": job["state"]})
+                done = []
+                for stage, status in job["stages"].items():
+                    if stage not in STAGES or statuses.get(stage, "queued") == status:
+                        continue
+                    print(f"[*] {data}: {stage} {status}")
+                    statuses[stage] = status
+                    if status == "done":
+                        done.append(stage)
+                    else:
+                        await sio.emit("stage_update", {"sha256": data, "stage": stage, "status": status})
+                if done:
+                    # One bundle for the stages done together, relayed
+                    # alongside the rest of the job
+                    relays.append(asyncio.create_task(
+                        publish_stages(vm_agent, data, done, timings)))
+        timings["vm"] = time.monotonic() - started - timings["upload"]
+
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        print(f"[-] Analysis of {data} on VM Agent {vm_agent} failed: {e}")
+        await asyncio.gather(*relays)
+        return "file_failed", {"sha256": data, "error": str(e)[:200]}
+
+    vm_done = time.monotonic()
+    relayed = True
+    # A VM agent without jobs only answers when it is finished
+    if "job_id" not in job:
+        relayed = await relay_reports(vm_agent, data, STAGES, timings)
+    relayed = all(await asyncio.gather(*relays)) and relayed
+    timings["report_wait"] = time.monotonic() - vm_done
+    timings["total"] = time.monotonic() - started
+    print(f"[*] {data} timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+
+    if job.get("state") == "failed" or statuses.get("dynamic") == "failed":
+        error = job.get("error") or "dynamic analysis failed"
+        return "file_failed", {"sha256": data, "error": error[:200]}
+    if not relayed:
+        return "file_failed", {"sha256": data, "error": "reports could not be relayed to Data Access"}
+
+    return "file_processed", {"sha256": data, "timings": timings}
+
+async def run_on_idle_vm(data):
+    pvm = await pool.acquire(data)
+    cancelled = False
+    try:
+        print(f"\n[+] Processing file: {data} on {pvm.name}\n")
+        event, result = await analyze(pvm.agent_url, data)
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        if cancelled:
+            # The VM may still be detonating the sample: bring it back
+            # clean before it takes another one
+            await pool.reset(pvm, f"analysis of {data} cancelled")
+        else:
+            await pool.release(pvm)
+    # Tell Core this sample is over so it can assign the next one, only
+    # once the VM is released: a VM going back to its snapshot has already
+    # been taken off the slots Core sees
+    await sio.emit(event, result)
 
-                print(f"[+] {filename} uploaded successfully to Data Access.")
+@sio.event
+async def file_sha256(data):
+    # Analyze in the background so this client keeps handling events;
+    # core sends no more samples than this host has VMs
+    task = asyncio.create_task(run_on_idle_vm(data))
+    analyses[data] = task
+    task.add_done_callback(lambda done: analyses.pop(data, None)
+                           if analyses.get(data) is done else None)
 
-            except requests.exceptions.RequestException as e:
-                print(f"[-] Failed to fetch or upload {filename}: {e}")
+@sio.event
+async def cancel_analysis(data):
+    # Core gave up on this sample (no progress in time) and requeued it,
+    # maybe to another host: stop working on it here
+    print(f"[!] Core cancelled the analysis of {data}")
+    task = analyses.get(data)
+    if task is not None:
+        task.cancel()
+
+async def heartbeat():
+    # The analysis slots of the fleet are counted from these records
+    while True:
+        data = {
+            "role": "host",
+            "capacity": pool.usable(),
+            "busy": pool.counts()["busy"],
+            "current_samples": list(analyses),
+            "ttl": HEARTBEAT_TTL,
+        }
+        try:
+            async with http_session.post(
+                f"{services.DATA_ACCESS}{Endpoints.WORKERS}{HOST_ID}/heartbeat", json=data
+            ) as r:
+                if r.status != 200:
+                    print(f"[-] Heartbeat rejected: {r.status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"[-] Error sending heartbeat: {e}")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+async def leave_fleet():
+    try:
+        async with http_session.delete(f"{services.DATA_ACCESS}{Endpoints.WORKERS}{HOST_ID}") as r:
+            print(f"[*] Left the fleet: {r.status}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"[-] Error leaving the fleet: {e}")
 
 @sio.event
-def disconnect():
+async def disconnect():
     print("Disconnected from Core server.")
 
-if __name__ == "__main__":
-
-    vms[0].start()
-    # Wait for the guest to be ready  
-    if vms[0].wait_for_guest_ready():
-        vms[0].mount_iso(ISO_PATH)
+async def get_pool(request):
+    return web.json_response(pool.snapshot_state())
+
+async def serve_pool_status():
+    app = web.Application()
+    app.router.add_get("/pool", get_pool)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", HOST_STATUS_PORT).start()
+    return runner
+
+async def main():
+    global http_session, pool, report_slots
+    if not vm_agent_urls:
+        print("[-] No VM agent URL configured (VM_AGENT_URLS)")
+        return
 
+    # Without VMX_PATHS the VMs are managed elsewhere and every agent URL
+    # is a VM; otherwise only VMs with both a VMX path and an agent URL
+    # are used, so no slot points at a VM that is not there
+    if vms and len(vms) != len(vm_agent_urls):
+        paired = min(len(vms), len(vm_agent_urls))
+        print(f"[!] {len(vms)} VM(s) in VMX_PATHS but {len(vm_agent_urls)} VM agent URL(s), "
+              f"using the first {paired}")
+        del vms[paired:]
+        del vm_agent_urls[paired:]
+
+    report_slots = asyncio.Semaphore(REPORT_CONCURRENCY)
+    # Every busy VM holds a job stream open next to the report transfers
+    pool_size = max(HTTP_POOL_SIZE, 2 * len(vm_agent_urls) + REPORT_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=HTTP_KEEPALIVE)
+    http_session = aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+
+    # Boot every VM at once, in the background: core hears about each VM
+    # as it becomes ready
+    pool = VMPool(vms, vm_agent_urls, http_session, iso_path=ISO_PATH,
+                  snapshot=CLEAN_SNAPSHOT, on_change=advertise_slots)
+    await pool.start()
+    status_server = await serve_pool_status()
+    heartbeat_task = asyncio.create_task(heartbeat())
     try:
-        print(f"[*] Connecting to Core at {services.CORE}...")
-        sio.connect(services.CORE)
-        sio.wait()
+        print(f"[*] Connecting to Core at {services.CORE} with {len(vm_agent_urls)} VM(s)...")
+        await sio.connect(services.CORE)
+        await sio.wait()
     except Exception as e:
         print(f"[-] Connection error: {e}")
+    finally:
+        heartbeat_task.cancel()
+        await leave_fleet()
+        await status_server.cleanup()
+        await http_session.close()
 
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -115,7 +115,7 @@ class VM:
             return "IP not found (Is the VM running and VMware Tools installed?)"
     
     def revert_to_snapshot(self, snapshot_name=None):
-        """Revert the VM to a snapshot."""
+        """Revert the VM to a snapshot. Returns True on success."""
         # If no name is provided, it reverts to the 'current' (most recent) snapshot
         if snapshot_name:
             cmd = [self.vmrun_path, "-T", "ws", "revertToSnapshot", self.vmx_path, snapshot_name]
@@ -124,14 +124,16 @@ class VM:
             # Note: some versions of vmrun require a name. 
             # If this fails, you must provide the specific name.
             print("Error: Please provide a snapshot name.")
-            return
+            return False
 
         result = subprocess.run(cmd, capture_output=True, text=True)
         
         if result.returncode == 0:
             print("Success: VM reverted.")
+            return True
         else:
             print(f"Failed to revert. Error: {result.stderr}")
+            return False
     
     def list_snapshots(self):
         """List all available snapshots for the VM."""
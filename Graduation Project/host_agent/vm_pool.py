@@ -0,0 +1,256 @@
+import asyncio
+import time
+
+import aiohttp
+
+# Lifecycle of a pooled VM:
+#   off → booting → ready ⇄ busy       (no clean snapshot)
+#   busy → reverting → booting → ready  (recycled after every job)
+#   faulted → (replaced in the background) → booting
+VM_STATES = ("off", "booting", "ready", "busy", "reverting", "faulted")
+
+
+class PooledVM:
+    """One VM of the pool: its vmrun handle (None if not managed here), guest agent and state."""
+
+    def __init__(self, index, vm, agent_url):
+        self.index = index
+        self.vm = vm
+        self.agent_url = agent_url
+        self.state = "off"
+        self.since = time.time()
+        self.job = None
+        self.error = None
+        self.faults = 0
+
+    @property
+    def name(self):
+        return f"VM {self.index + 1}"
+
+    def describe(self):
+        return {
+            "index": self.index,
+            "vmx_path": self.vm.vmx_path if self.vm else None,
+            "agent_url": self.agent_url,
+            "state": self.state,
+            "since": self.since,
+            "job": self.job,
+            "error": self.error,
+            "faults": self.faults,
+        }
+
+
+class VMPool:
+    """
+    The analysis VMs of a host. Boots, reverts and replacements run in
+    worker threads (vmrun blocks), all VMs at once, so a slow or faulted
+    VM never holds up the others. acquire() hands out a ready VM to a job.
+
+    With a clean snapshot, a VM is never reused as is: release() sends it
+    back to the snapshot and boots it in the background while the warm
+    VMs take the next samples. Take the snapshot of a running guest with
+    its agent up, so the boot is a resume of a few seconds.
+
+    on_change(pool) is awaited whenever the number of usable VMs changes,
+    e.g. to tell Core how many samples this host can take.
+    """
+
+    def __init__(self, vms, agent_urls, session, iso_path=None, snapshot=None,
+                 boot_timeout=300, health_timeout=5, health_interval=15,
+                 replace_delay=30, on_change=None):
+        self.vms = [PooledVM(i, vms[i] if i < len(vms) else None, url)
+                    for i, url in enumerate(agent_urls)]
+        self.session = session
+        self.iso_path = iso_path
+        self.snapshot = snapshot
+        self.boot_timeout = boot_timeout
+        self.health_timeout = health_timeout
+        self.health_interval = health_interval
+        self.replace_delay = replace_delay
+        self.on_change = on_change
+        self._changed = asyncio.Condition()
+        self._tasks = set()
+        self._usable = 0
+
+    # Queries
+
+    def size(self):
+        return len(self.vms)
+
+    def counts(self):
+        """state → number of VMs in it."""
+        counts = dict.fromkeys(VM_STATES, 0)
+        for pvm in self.vms:
+            counts[pvm.state] += 1
+        return counts
+
+    def usable(self):
+        """VMs that can run a sample now or are running one."""
+        return sum(pvm.state in ("ready", "busy") for pvm in self.vms)
+
+    def snapshot_state(self):
+        return {"size": self.size(), "usable": self.usable(),
+                "states": self.counts(), "vms": [pvm.describe() for pvm in self.vms]}
+
+    # Lifecycle
+
+    async def start(self):
+        """Boot every VM (from the clean snapshot) in the background and start the health monitor."""
+        for pvm in self.vms:
+            self._spawn(self._recycle(pvm) if self._recyclable(pvm) else self._boot(pvm))
+        self._spawn(self._monitor())
+
+    async def acquire(self, job):
+        """Wait for a ready VM and mark it busy with `job`."""
+        async with self._changed:
+            pvm = None
+            while pvm is None:
+                pvm = next((pvm for pvm in self.vms if pvm.state == "ready"), None)
+                if pvm is None:
+                    await self._changed.wait()
+            self._apply(pvm, "busy", job)
+        await self._check_usable()
+        return pvm
+
+    async def release(self, pvm):
+        """
+        A job is over: the VM is recycled to the clean snapshot, or without
+        one, ready again if its agent still answers.
+        """
+        if self._recyclable(pvm):
+            # Out of service right away; core is told it has a slot less
+            await self._set_state(pvm, "reverting")
+            self._spawn(self._recycle(pvm))
+        elif await self.health_check(pvm):
+            await self._set_state(pvm, "ready")
+        else:
+            await self.fault(pvm, "agent stopped answering after a job")
+
+    async def fault(self, pvm, error):
+        """Take a VM out of service and replace it in the background."""
+        pvm.faults += 1
+        print(f"[!] {pvm.name} faulted: {error}")
+        await self._set_state(pvm, "faulted", error=error)
+        self._spawn(self._replace(pvm))
+
+    async def reset(self, pvm, reason):
+        """
+        Bring back a VM whose job was abandoned midway: recycled to the
+        clean snapshot, or else faulted and restarted, before it is used again.
+        """
+        print(f"[!] Resetting {pvm.name}: {reason}")
+        if self._recyclable(pvm):
+            await self._set_state(pvm, "reverting")
+            self._spawn(self._recycle(pvm))
+        else:
+            await self.fault(pvm, reason)
+
+    async def health_check(self, pvm):
+        """True if the guest agent answers and is not running a job."""
+        try:
+            async with self.session.get(f"{pvm.agent_url}/health",
+                                        timeout=aiohttp.ClientTimeout(total=self.health_timeout)) as r:
+                return r.status == 200 and (await r.json()).get("job") is None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return False
+
+    # Internals
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _apply(self, pvm, state, job=None, error=None):
+        """Change a VM's state; the caller holds self._changed."""
+        pvm.state = state
+        pvm.since = time.time()
+        pvm.job = job
+        pvm.error = error
+        self._changed.notify_all()
+        print(f"[#] {pvm.name}: {state}" + (f" ({job})" if job else ""))
+
+    async def _set_state(self, pvm, state, job=None, error=None):
+        async with self._changed:
+            self._apply(pvm, state, job, error)
+        await self._check_usable()
+
+    async def _check_usable(self):
+        usable = self.usable()
+        if usable != self._usable:
+            self._usable = usable
+            if self.on_change is not None:
+                await self.on_change(self)
+
+    def _recyclable(self, pvm):
+        return bool(self.snapshot) and pvm.vm is not None
+
+    def _power_on(self, vm):
+        vm.start()
+        # Wait for the guest to be ready
+        if not vm.wait_for_guest_ready(timeout=self.boot_timeout):
+            raise RuntimeError("guest tools never came up")
+        if self.iso_path:
+            vm.mount_iso(self.iso_path)
+
+    async def _boot(self, pvm):
+        """Power on a VM and wait until its guest agent answers."""
+        await self._set_state(pvm, "booting")
+        try:
+            if pvm.vm is not None:
+                await asyncio.to_thread(self._power_on, pvm.vm)
+        except Exception as e:
+            await self.fault(pvm, f"boot failed: {e}")
+            return False
+
+        deadline = time.monotonic() + self.boot_timeout
+        while time.monotonic() < deadline:
+            if await self.health_check(pvm):
+                pvm.faults = 0
+                await self._set_state(pvm, "ready")
+                return True
+            await asyncio.sleep(2)
+        await self.fault(pvm, "guest agent not ready in time")
+        return False
+
+    async def _revert(self, pvm):
+        """Revert a VM to the clean snapshot; False if that failed."""
+        await self._set_state(pvm, "reverting")
+        try:
+            return await asyncio.to_thread(pvm.vm.revert_to_snapshot, self.snapshot)
+        except Exception as e:
+            print(f"[!] Could not revert {pvm.name}: {e}")
+            return False
+
+    async def _recycle(self, pvm):
+        """Bring a VM back to the clean snapshot and boot it."""
+        started = time.monotonic()
+        if not await self._revert(pvm):
+            await self.fault(pvm, f"revert to {self.snapshot} failed")
+            return
+        if await self._boot(pvm):
+            print(f"[#] {pvm.name} recycled in {time.monotonic() - started:.1f}s")
+
+    async def _replace(self, pvm):
+        """Power-cycle a faulted VM (back to the clean snapshot if there is one)."""
+        # Back off when the same VM keeps faulting
+        await asyncio.sleep(self.replace_delay * min(2 ** (pvm.faults - 1), 16))
+        if self._recyclable(pvm):
+            await self._recycle(pvm)
+            return
+        if pvm.vm is not None:
+            try:
+                await asyncio.to_thread(pvm.vm.stop)
+            except Exception as e:
+                print(f"[!] Could not stop {pvm.name}: {e}")
+        await self._boot(pvm)
+
+    async def _monitor(self):
+        """Health-check idle VMs; a dead guest agent faults its VM."""
+        while True:
+            await asyncio.sleep(self.health_interval)
+            idle = [pvm for pvm in self.vms if pvm.state == "ready"]
+            results = await asyncio.gather(*(self.health_check(pvm) for pvm in idle))
+            for pvm, healthy in zip(idle, results):
+                if not healthy and pvm.state == "ready":
+                    await self.fault(pvm, "health check failed")
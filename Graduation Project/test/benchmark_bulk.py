@@ -0,0 +1,62 @@
+import argparse
+import io
+import os
+import time
+import zipfile
+
+import requests
+
+# Bulk ingestion benchmark: builds an archive of N small random samples,
+# sends it to /samples/bulk in one request and reports samples/sec.
+# Optionally times the same number of one-by-one uploads for comparison.
+#
+#   python benchmark_bulk.py --count 10000 --serial 200
+
+
+def build_archive(count, min_size, max_size):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zipf:
+        for i in range(count):
+            size = min_size + int.from_bytes(os.urandom(2), "big") % (max_size - min_size + 1)
+            zipf.writestr(f"sample_{i}.exe", os.urandom(size))
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:5001")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--min-size", type=int, default=4 * 1024)
+    parser.add_argument("--max-size", type=int, default=64 * 1024)
+    parser.add_argument("--serial", type=int, default=0,
+                        help="also time this many single-file uploads")
+    args = parser.parse_args()
+
+    print(f"Building archive of {args.count} samples...")
+    archive = build_archive(args.count, args.min_size, args.max_size)
+    print(f"Archive size: {len(archive) / 1024 ** 2:.1f} MB")
+
+    start = time.perf_counter()
+    response = requests.post(f"{args.url}/samples/bulk",
+                             files={"archive": ("bench.zip", archive)}, timeout=3600)
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    results = response.json()
+
+    new = sum(1 for r in results if not r["duplicate"])
+    print(f"bulk:   {len(results)} samples ({new} new) in {elapsed:.1f}s "
+          f"→ {len(results) / elapsed:.0f} samples/s")
+
+    if args.serial:
+        start = time.perf_counter()
+        with requests.Session() as session:
+            for i in range(args.serial):
+                files = {"file": (f"serial_{i}.exe", os.urandom(args.min_size))}
+                session.post(f"{args.url}/samples/upload/", files=files).raise_for_status()
+        elapsed = time.perf_counter() - start
+        print(f"serial: {args.serial} samples in {elapsed:.1f}s "
+              f"→ {args.serial / elapsed:.0f} samples/s")
+
+
+if __name__ == "__main__":
+    main()
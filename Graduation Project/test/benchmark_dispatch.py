@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import aiohttp
+import socketio
+
+# Dispatch latency benchmark: acts as a host connected to core, uploads
+# samples to data access one at a time and measures the time from the
+# upload request until core emits file_sha256 for that sample.
+#
+#   python benchmark_dispatch.py --samples 20
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--core-url", default="http://localhost:5002")
+    parser.add_argument("--data-access-url", default="http://localhost:5001")
+    parser.add_argument("--samples", type=int, default=20)
+    args = parser.parse_args()
+
+    sio = socketio.AsyncClient()
+    arrivals = {}  # sha256 → time file_sha256 was received
+    arrived = asyncio.Event()
+
+    @sio.on("file_sha256")
+    async def file_sha256(data):
+        arrivals[data] = time.perf_counter()
+        arrived.set()
+        # Report back straight away so core can dispatch the next sample
+        await sio.emit("file_processed", {"sha256": data})
+
+    async def wait_for_dispatch(sha256):
+        # The emit can beat the upload response, so check before waiting
+        while sha256 not in arrivals:
+            arrived.clear()
+            await arrived.wait()
+        return arrivals[sha256]
+
+    await sio.connect(args.core_url)
+    latencies = []
+
+    async with aiohttp.ClientSession() as session:
+        for _ in range(args.samples):
+            data = aiohttp.FormData()
+            data.add_field("file", os.urandom(1024), filename="bench.exe")
+
+            sent = time.perf_counter()
+            async with session.post(f"{args.data_access_url}/samples/upload/", data=data) as resp:
+                sha256 = (await resp.json())["hash_sha256"]
+            received = await asyncio.wait_for(wait_for_dispatch(sha256), timeout=120)
+            latencies.append((received - sent) * 1000)
+            # Give core time to record the analysis before the next upload
+            await asyncio.sleep(0.2)
+
+    await sio.disconnect()
+
+    latencies.sort()
+    print(f"upload → file_sha256 over {len(latencies)} samples: "
+          f"p50 {statistics.median(latencies):.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms, "
+          f"max {latencies[-1]:.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import os
+import time
+from collections import Counter
+
+import aiohttp
+import socketio
+
+# Dispatch scaling benchmark: connects N simulated hosts to core, each
+# "analyzing" a sample for a fixed time, uploads a batch of samples and
+# reports the throughput. Checks that no sample was sent to two hosts.
+#
+#   python benchmark_hosts.py --hosts 1 2 4 --samples 40 --analysis-time 0.5
+
+
+async def run_hosts(args, count):
+    assigned = Counter()
+    done = asyncio.Event()
+    expected = set()
+    finished = set()
+    hosts = []
+
+    for _ in range(count):
+        sio = socketio.AsyncClient()
+
+        def make_handler(sio):
+            async def file_sha256(data):
+                assigned[data] += 1
+                await asyncio.sleep(args.analysis_time)
+                await sio.emit("file_processed", {"sha256": data})
+                finished.add(data)
+                done.set()
+            return file_sha256
+
+        sio.on("file_sha256", make_handler(sio))
+        await sio.connect(args.core_url)
+        await sio.emit("register", {"slots": args.slots})
+        hosts.append(sio)
+
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        for _ in range(args.samples):
+            data = aiohttp.FormData()
+            data.add_field("file", os.urandom(1024), filename="bench.exe")
+            async with session.post(f"{args.data_access_url}/samples/upload/", data=data) as resp:
+                expected.add((await resp.json())["hash_sha256"])
+        while not expected <= finished:
+            done.clear()
+            await asyncio.wait_for(done.wait(), timeout=600)
+        elapsed = time.perf_counter() - start
+
+    for sio in hosts:
+        await sio.disconnect()
+
+    duplicates = [sha256 for sha256, n in assigned.items() if n > 1]
+    print(f"{count} host(s): {len(expected)} samples in {elapsed:.1f}s "
+          f"→ {len(expected) / elapsed:.1f} samples/s, "
+          f"{len(duplicates)} assigned more than once")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--core-url", default="http://localhost:5002")
+    parser.add_argument("--data-access-url", default="http://localhost:5001")
+    parser.add_argument("--hosts", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--slots", type=int, default=1, help="slots per host")
+    parser.add_argument("--samples", type=int, default=40)
+    parser.add_argument("--analysis-time", type=float, default=0.5)
+    args = parser.parse_args()
+
+    for count in args.hosts:
+        await run_hosts(args, count)
+        # Let core notice the disconnects before the next round
+        await asyncio.sleep(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
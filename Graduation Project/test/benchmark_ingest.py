@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+# Import the ingestion code straight from the data access service
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "data_access_service"))
+
+SIZES = {"1 MB": 1024 ** 2, "100 MB": 100 * 1024 ** 2, "1 GB": 1024 ** 3}
+
+
+def make_sample(path, size):
+    """Write `size` random bytes to `path` without holding them in memory."""
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining:
+            n = min(remaining, 1024 * 1024)
+            f.write(os.urandom(n))
+            remaining -= n
+
+
+def run_streaming(sample_path, upload_dir, result):
+    from ingest import store_sample
+
+    start = time.perf_counter()
+    with open(sample_path, "rb") as f:
+        store_sample(f, upload_dir)
+    result["seconds"] = time.perf_counter() - start
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_hash_then_zip(sample_path, upload_dir, result):
+    """What create_sample does: hash, check for a duplicate, zip a new sample from the spool."""
+    from ingest import hash_sample, zip_sample
+
+    start = time.perf_counter()
+    with open(sample_path, "rb") as f:
+        hashes = hash_sample(f)
+        f.seek(0)
+        zip_sample(f, upload_dir, hashes["hash_sha256"])
+    result["seconds"] = time.perf_counter() - start
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_buffered(sample_path, upload_dir, result):
+    """The previous create_sample: read everything, hash three times, writestr."""
+    import hashlib
+    import pyzipper
+
+    start = time.perf_counter()
+    with open(sample_path, "rb") as f:
+        contents = f.read()
+    hashes = [hashlib.new(algo, contents).hexdigest()
+              for algo in ("md5", "sha1", "sha256")]
+    zip_filename = os.path.join(upload_dir, f"{hashes[2]}.zip")
+    with pyzipper.AESZipFile(zip_filename, 'w', compression=pyzipper.ZIP_DEFLATED,
+                             encryption=pyzipper.WZ_AES) as zipf:
+        zipf.setpassword("infected".encode())
+        zipf.writestr("sample", contents)
+    result["seconds"] = time.perf_counter() - start
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(target, sample_path, upload_dir):
+    # A fresh process per run so peak RSS is not polluted by earlier runs
+    with multiprocessing.Manager() as manager:
+        result = manager.dict()
+        proc = multiprocessing.get_context("spawn").Process(
+            target=target, args=(sample_path, upload_dir, result))
+        proc.start()
+        proc.join()
+        return dict(result)
+
+
+def main():
+    sizes = sys.argv[1:] or list(SIZES)
+
+    print(f"{'size':>8} {'mode':>10} {'seconds':>9} {'MB/s':>9} {'peak RSS MB':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in sizes:
+            size = SIZES[label]
+            sample_path = os.path.join(tmp, "sample.bin")
+            make_sample(sample_path, size)
+
+            for mode, target in (("buffered", run_buffered), ("streaming", run_streaming),
+                                 ("hash+zip", run_hash_then_zip)):
+                upload_dir = tempfile.mkdtemp(dir=tmp)
+                result = measure(target, sample_path, upload_dir)
+                mb = size / 1024 ** 2
+                print(f"{label:>8} {mode:>10} {result['seconds']:>9.2f} "
+                      f"{mb / result['seconds']:>9.1f} {result['peak_rss_kb'] / 1024:>12.1f}")
+
+            os.remove(sample_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "data_access_service"))
+
+from database import Base  # noqa: E402
+from models import Sample  # noqa: E402
+from crud import list_samples, encode_cursor  # noqa: E402
+
+ROWS = 1_000_000
+PAGE_SIZE = 100
+PAGES = [1, 100, 1_000, 10_000]
+REPEAT = 20
+
+
+def populate(session):
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i in range(ROWS):
+        batch.append({
+            "hash_md5": f"{i:032x}",
+            "hash_sha1": f"{i:040x}",
+            "hash_sha256": f"{i:064x}",
+            "file_name": f"sample_{i}.exe",
+            "file_size": 1024 + i % 4096,
+            "file_type": ("exe", "dll", "zip")[i % 3],
+            "upload_date": start + timedelta(seconds=i),
+            "static_analysis": i % 2 == 0,
+            "dynamic_analysis": i % 4 == 0,
+        })
+        if len(batch) == 50_000:
+            session.execute(insert(Sample), batch)
+            batch = []
+    if batch:
+        session.execute(insert(Sample), batch)
+    session.commit()
+
+
+def time_call(fn):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+
+        print(f"Inserting {ROWS:,} samples...")
+        populate(session)
+
+        print(f"{'page':>7} {'offset ms':>10} {'keyset ms':>10}")
+        for page in PAGES:
+            skip = (page - 1) * PAGE_SIZE
+
+            # Cursor of the page is the last row of the previous page
+            cursor = None
+            if skip:
+                last = session.query(Sample.upload_date, Sample.id) \
+                    .order_by(Sample.upload_date.desc(), Sample.id.desc()) \
+                    .offset(skip - 1).limit(1).one()
+                cursor = encode_cursor(last.upload_date, last.id)
+
+            offset_ms = time_call(lambda: session.query(Sample)
+                                  .order_by(Sample.upload_date.desc(), Sample.id.desc())
+                                  .offset(skip).limit(PAGE_SIZE).all())
+            keyset_ms = time_call(lambda: list_samples(
+                session, limit=PAGE_SIZE, cursor=cursor))
+
+            print(f"{page:>7} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
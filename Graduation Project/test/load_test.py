@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import os
+import time
+
+import aiohttp
+
+# Load test for the data access service: N concurrent clients hammer the
+# upload and lookup endpoints and the script reports requests/sec.
+#
+# Start the service against the SQLite stand-in first:
+#   DB_PROFILE=sqlite python main.py
+# then run:
+#   python load_test.py --clients 50 --duration 30
+
+
+async def upload_worker(session, url, deadline, stats, known):
+    while time.perf_counter() < deadline:
+        data = aiohttp.FormData()
+        data.add_field("file", os.urandom(4096), filename="load.exe")
+        try:
+            async with session.post(f"{url}/samples/upload/", data=data) as resp:
+                if resp.status != 200:
+                    # Error pages are not necessarily JSON
+                    await resp.read()
+                    stats["failed"] += 1
+                    continue
+                body = await resp.json()
+        except aiohttp.ClientError:
+            stats["failed"] += 1
+            continue
+        stats["ok"] += 1
+        known.append(body["hash_sha256"])
+
+
+async def lookup_worker(session, url, deadline, stats, known):
+    i = 0
+    while time.perf_counter() < deadline:
+        sha256 = known[i % len(known)]
+        i += 1
+        try:
+            async with session.get(f"{url}/samples/{sha256}") as resp:
+                await resp.read()
+                stats["ok" if resp.status == 200 else "failed"] += 1
+        except aiohttp.ClientError:
+            stats["failed"] += 1
+
+
+async def run(mode, url, clients, duration, known):
+    stats = {"ok": 0, "failed": 0}
+    worker = upload_worker if mode == "upload" else lookup_worker
+    connector = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session, url, deadline, stats, known)
+                               for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    print(f"{mode:>7}: {stats['ok'] / elapsed:8.1f} req/s "
+          f"({stats['ok']} ok, {stats['failed']} failed, {clients} clients, {elapsed:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:5001")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30)
+    args = parser.parse_args()
+
+    # Uploads run first so the lookups have real hashes to query
+    known = []
+    asyncio.run(run("upload", args.url, args.clients, args.duration, known))
+    if not known:
+        print(" lookup: skipped, no upload succeeded")
+        return
+    asyncio.run(run("lookup", args.url, args.clients, args.duration, known))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 import requests
 
-# List of clients to send
+# Presence record of a fake core with two connected clients
 data = {
+    "role": "core",
     "clients": ["LBDpCtraBFIalrAAAAAB", "asdsssCtraBFIalrAAAAAB"]
 }
 
 # Send POST request with JSON body
-response = requests.post("http://localhost:5001/update_core/", json=data)
+response = requests.post(
+    "http://localhost:5001/workers/test-core/heartbeat", json=data)
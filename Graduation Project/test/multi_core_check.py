@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import aiohttp
+import socketio
+
+# Multi-core check: starts several core processes sharing one Redis,
+# connects simulated hosts to them round-robin (standing in for a load
+# balancer), uploads samples and kills one core halfway through. Its hosts
+# reconnect to the surviving cores and finish their samples there.
+# Fails if any sample is dispatched twice or never completes.
+#
+# Needs the data access service and Redis running:
+#   python multi_core_check.py --cores 3 --hosts 6 --samples 60
+
+CORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "core")
+
+
+def start_core(port, redis_url, log_dir=None):
+    env = dict(os.environ, CORE_PORT=str(port), REDIS_URL=redis_url,
+               SOCKETIO_MESSAGE_QUEUE=redis_url, PYTHONUNBUFFERED="1")
+    log = open(os.path.join(log_dir, f"core-{port}.log"), "w") if log_dir else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, "core.py"], cwd=CORE_DIR, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+class Host:
+    def __init__(self, host_id, core_urls, analysis_time, dispatched, finished):
+        self.host_id = host_id
+        self.core_urls = core_urls
+        self.analysis_time = analysis_time
+        self.dispatched = dispatched
+        self.finished = finished
+        self.sio = None
+        self.tasks = set()
+
+    async def connect(self, index):
+        # Try the cores in turn from `index`, as a load balancer would
+        for attempt in range(len(self.core_urls)):
+            url = self.core_urls[(index + attempt) % len(self.core_urls)]
+            sio = socketio.AsyncClient(reconnection=False)
+            sio.on("file_sha256", self.file_sha256)
+            sio.on("disconnect", lambda: asyncio.create_task(self.reconnect(index + attempt + 1)))
+            try:
+                await sio.connect(url)
+            except socketio.exceptions.ConnectionError:
+                continue
+            self.sio = sio
+            await sio.emit("register", {"host_id": self.host_id, "slots": 1})
+            return
+        raise RuntimeError(f"{self.host_id}: no core reachable")
+
+    async def reconnect(self, index):
+        await asyncio.sleep(0.5)
+        await self.connect(index)
+
+    async def file_sha256(self, sha256):
+        # Analyze in the background so this client keeps handling events
+        self.dispatched[sha256] += 1
+        task = asyncio.create_task(self.analyze(sha256))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def analyze(self, sha256):
+        await asyncio.sleep(self.analysis_time * random.uniform(0.5, 1.5))
+        # The core may have died meanwhile; report once reconnected
+        while self.sio is None or not self.sio.connected:
+            await asyncio.sleep(0.1)
+        await self.sio.emit("file_processed", {"sha256": sha256})
+        self.finished.add(sha256)
+
+    async def close(self):
+        if self.sio is not None:
+            self.sio.handlers["/"].pop("disconnect", None)
+            await self.sio.disconnect()
+
+
+async def run(args):
+    core_urls = [f"http://localhost:{args.base_port + i}" for i in range(args.cores)]
+    dispatched = Counter()
+    finished = set()
+    hosts = [Host(f"host-{i}", core_urls, args.analysis_time, dispatched, finished)
+             for i in range(args.hosts)]
+    for i, host in enumerate(hosts):
+        await host.connect(i)
+
+    expected = set()
+    async with aiohttp.ClientSession() as session:
+        for i in range(args.samples):
+            data = aiohttp.FormData()
+            data.add_field("file", os.urandom(1024), filename="multi.exe")
+            async with session.post(f"{args.data_access_url}/samples/upload/", data=data) as resp:
+                expected.add((await resp.json())["hash_sha256"])
+            if i == args.samples // 2:
+                print("Killing the first core")
+                args.processes[0].send_signal(signal.SIGKILL)
+
+    deadline = time.monotonic() + args.timeout
+    while not expected <= finished and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+
+    for host in hosts:
+        await host.close()
+
+    twice = [sha256 for sha256 in expected if dispatched[sha256] > 1]
+    missing = expected - finished
+    print(f"{len(expected)} samples, {args.cores} cores, {args.hosts} hosts: "
+          f"{len(twice)} dispatched more than once, {len(missing)} never finished")
+    return not twice and not missing
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-access-url", default="http://localhost:5001")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    parser.add_argument("--cores", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=5002)
+    parser.add_argument("--hosts", type=int, default=6)
+    parser.add_argument("--samples", type=int, default=60)
+    parser.add_argument("--analysis-time", type=float, default=0.3)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--log-dir", help="write each core's output here")
+    args = parser.parse_args()
+
+    args.processes = [start_core(args.base_port + i, args.redis_url, args.log_dir)
+                      for i in range(args.cores)]
+    try:
+        time.sleep(3)
+        ok = asyncio.run(run(args))
+    finally:
+        for process in args.processes:
+            process.terminate()
+            process.wait()
+
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
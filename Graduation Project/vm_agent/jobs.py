@@ -0,0 +1,115 @@
+import threading
+import time
+
+# Job states in pipeline order; done and failed are final
+JOB_STATES = ("accepted", "extracting", "static", "detonating", "analyzing", "done", "failed")
+FINAL_STATES = ("done", "failed")
+
+# Analysis stages whose reports the host publishes as each one ends
+STAGES = ("static", "dynamic", "network")
+
+# Finished jobs kept around for late readers
+MAX_FINISHED_JOBS = 100
+
+
+class JobTable:
+    """
+    Analysis jobs of this VM agent. Every change bumps the job's version
+    and wakes up the readers waiting on it, so the host learns about a new
+    state the moment it is reached instead of polling on a timer.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._changed = threading.Condition()
+
+    def create(self, job_id):
+        """
+        Start a job. Returns (job, True), or (job in progress, False) if
+        one is already running: a VM analyzes one sample at a time.
+        """
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "state": "accepted",
+            "stages": {stage: "queued" for stage in STAGES},
+            "history": [{"state": "accepted", "at": now}],
+            "error": None,
+            "version": 1,
+        }
+        with self._changed:
+            for other in self._jobs.values():
+                if other["state"] not in FINAL_STATES:
+                    return self._copy(other), False
+            self._jobs.pop(job_id, None)
+            self._jobs[job_id] = job
+            self._forget_old()
+            self._changed.notify_all()
+            return self._copy(job), True
+
+    def set_state(self, job_id, state, error=None):
+        with self._changed:
+            job = self._jobs[job_id]
+            job["state"] = state
+            job["history"].append({"state": state, "at": time.time()})
+            if error:
+                job["error"] = error
+            self._bump(job)
+
+    def set_stage(self, job_id, stage, status):
+        with self._changed:
+            job = self._jobs[job_id]
+            job["stages"][stage] = status
+            self._bump(job)
+
+    def set_stages(self, job_id, **statuses):
+        """Change several stages at once, as one version."""
+        with self._changed:
+            job = self._jobs[job_id]
+            job["stages"].update(statuses)
+            self._bump(job)
+
+    def get(self, job_id):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return self._copy(job) if job else None
+
+    def running(self):
+        """Id of the job in progress, or None if the VM is idle."""
+        with self._changed:
+            for job in self._jobs.values():
+                if job["state"] not in FINAL_STATES:
+                    return job["job_id"]
+        return None
+
+    def wait(self, job_id, version, timeout):
+        """
+        Block until the job is past `version` or finished, for at most
+        `timeout` seconds. Returns the job (unchanged on timeout), or None
+        if it is unknown.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return None
+                remaining = deadline - time.monotonic()
+                if (job["version"] > version or job["state"] in FINAL_STATES
+                        or remaining <= 0):
+                    return self._copy(job)
+                self._changed.wait(remaining)
+
+    def _bump(self, job):
+        job["version"] += 1
+        self._changed.notify_all()
+
+    def _forget_old(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job["state"] in FINAL_STATES]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _copy(job):
+        return dict(job, stages=dict(job["stages"]), history=list(job["history"]))
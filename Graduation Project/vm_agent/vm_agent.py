@@ -1,13 +1,20 @@
 import hashlib
+import io
 import subprocess
+import tarfile
+import tempfile
 import os
 import json
+import threading
 import time
 import aiofiles
 from fastapi import FastAPI, HTTPException, Header, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 import pyzipper
 import uvicorn
+from starlette.background import BackgroundTask
+from jobs import JobTable, FINAL_STATES, STAGES
 
 
 UPLOAD_FOLDER = r"C:\covid_rat\uploads"
@@ -20,15 +27,20 @@ RENAME_PY = r"C:\covid_rat\rename.py"
 HOST = "0.0.0.0"
 PORT = 5003
 
-# Store the hashes of the reports to prevent duplicates
-json_hashes = {}  # key: filename, value: hash
-report_hashes = {}  # key: filename, value: hash
+# Seconds between repeats of an unchanged job on /jobs/{job_id}/events
+EVENTS_KEEPALIVE = 15
+
+# Reports of a job: OUTPUT_FOLDER/<job_id>_<stage>.<ext>
+REPORT_EXTENSIONS = (".json", ".txt")
 
 # Create uploads directory
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app = FastAPI()
 
+# Analysis jobs, one at a time on this VM
+jobs = JobTable()
+
 
 def calculate_sha256(file_path: str) -> str:
     sha256_hash = hashlib.sha256()
@@ -69,94 +81,225 @@ def rename_to_exe(folder):
     return None
 
 
-@app.post("/upload")
+@app.post("/upload", status_code=202)
 async def upload_file(
     request: Request,
     x_filename: str = Header(None),
 ):
+    """
+    Store a sample zip and start analyzing it in the background. Returns
+    the job; its progress is read from /jobs/{job_id}/wait or /events.
+    """
     if not x_filename:
         raise HTTPException(
             status_code=400, detail="Missing X-Filename header")
 
+    job_id = os.path.splitext(os.path.basename(x_filename))[0]
+    job, created = jobs.create(job_id)
+    if not created:
+        if job["job_id"] == job_id:
+            return job
+        raise HTTPException(
+            status_code=409, detail=f"Busy with job {job['job_id']}")
+
     file_path = os.path.join(UPLOAD_FOLDER, x_filename)
 
-    async with aiofiles.open(file_path, "wb") as f:
-        async for chunk in request.stream():
-            await f.write(chunk)
+    try:
+        async with aiofiles.open(file_path, "wb") as f:
+            async for chunk in request.stream():
+                await f.write(chunk)
+    except Exception as e:
+        jobs.set_state(job_id, "failed", error=f"Upload failed: {e}")
+        raise
+
+    threading.Thread(target=run_job, args=(job_id, file_path), daemon=True).start()
+    return job
+
+
+@app.get("/health")
+def health():
+    """Liveness probe for the host's VM pool."""
+    return {"status": "ok", "job": jobs.running()}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/wait")
+async def wait_job(job_id: str, version: int = 0, timeout: float = 30):
+    """
+    Long poll: answers as soon as the job is past `version` or finished,
+    or with the unchanged job after `timeout` seconds.
+    """
+    job = await run_in_threadpool(jobs.wait, job_id, version, min(timeout, 60))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Push channel: one NDJSON line with the job on every change, until it
+    is done or failed. Repeated unchanged every EVENTS_KEEPALIVE seconds.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream(job):
+        yield json.dumps(job) + "\n"
+        while job["state"] not in FINAL_STATES:
+            job = await run_in_threadpool(jobs.wait, job_id, job["version"], EVENTS_KEEPALIVE)
+            if job is None:
+                return
+            yield json.dumps(job) + "\n"
+
+    return StreamingResponse(stream(job), media_type="application/x-ndjson")
+
 
+def run_job(job_id, file_path):
+    """Run the analysis pipeline of one job in a worker thread."""
+    try:
+        run_pipeline(job_id, file_path)
+    except Exception as e:
+        print(f"[-] Job {job_id} failed: {e}")
+        jobs.set_state(job_id, "failed", error=str(e)[:200])
+
+
+def run_pipeline(job_id, file_path):
+    """
+    Extract, then run the static, dynamic and network stages, recording
+    each transition in the job table so the host can publish each stage's
+    reports as soon as it is done.
+    """
+    jobs.set_state(job_id, "extracting")
     # Extract the AES-encrypted ZIP
     try:
         with pyzipper.AESZipFile(file_path, 'r') as zipf:
             zipf.setpassword(ZIP_PASSWORD.encode())
             zipf.extractall(path=UPLOAD_FOLDER)
     except (pyzipper.BadZipFile, RuntimeError) as e:
-        raise HTTPException(status_code=500, detail=f"Extraction failed: {e}")
+        jobs.set_state(job_id, "failed", error=f"Extraction failed: {e}")
+        return
 
     exe_path = rename_to_exe(UPLOAD_FOLDER)
 
     if not exe_path:
-        raise HTTPException(status_code=400, detail="No EXE found")
+        jobs.set_state(job_id, "failed", error="No EXE found")
+        return
 
     print("[*] Running static analysis...")
-    subprocess.run([PYTHON_EXE, STATIC_PY], check=True)
-
-    # Store the hash of "Sha256_static.json", "analysis_report_static.txt", to ensure integrity
-    static_json_path = os.path.join(OUTPUT_FOLDER, "Sha256_static.json")
-    static_txt_path = os.path.join(OUTPUT_FOLDER, "analysis_report_static.txt")
-    if os.path.exists(static_json_path):
-        static_hash = calculate_sha256(static_json_path)
-        json_hashes["_static.json"] = static_hash
-        print(f"[+] Stored hash of Sha256_static.json: {static_hash}")
-
-    if os.path.exists(static_txt_path):
-        static_txt_hash = calculate_sha256(static_txt_path)
-        report_hashes["static.txt"] = static_txt_hash
-        print(
-            f"[+] Stored hash of analysis_report_static.txt: {static_txt_hash}")
+    jobs.set_state(job_id, "static")
+    jobs.set_stage(job_id, "static", "running")
+    try:
+        subprocess.run([PYTHON_EXE, STATIC_PY], check=True)
+
+        static_json_path = os.path.join(OUTPUT_FOLDER, "Sha256_static.json")
+        static_txt_path = os.path.join(OUTPUT_FOLDER, "analysis_report_static.txt")
+        static_done = os.path.exists(static_json_path)
+
+        # Give the static reports their final names now instead of after
+        # the dynamic run, so they can be fetched right away
+        for path, suffix in ((static_json_path, "_static.json"), (static_txt_path, "_static.txt")):
+            if os.path.exists(path):
+                os.replace(path, os.path.join(OUTPUT_FOLDER, job_id + suffix))
+        jobs.set_stage(job_id, "static", "done" if static_done else "failed")
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"[-] Static analysis failed: {e}")
+        jobs.set_stage(job_id, "static", "failed")
 
     print("[*] Waiting 2 seconds...")
     time.sleep(2)
 
     print("[*] Running main.py...")
-    subprocess.run([PYTHON_EXE, MAIN_PY], check=True)
-
-    # Store the hash of Sha256_dynamic.json, analysis_report.txt, sha256_net.json, analysis_report_network.txt
-    #  file, to ensure integrity
-    dynamic_json_path = os.path.join(OUTPUT_FOLDER, "Sha256_dynamic.json")
-    dynamic_txt_path = os.path.join(OUTPUT_FOLDER, "analysis_report.txt")
-    network_json_path = os.path.join(OUTPUT_FOLDER, "sha256_net.json")
-    network_txt_path = os.path.join(
-        OUTPUT_FOLDER, "analysis_report_network.txt")
-
-    if os.path.exists(dynamic_json_path):
-        dynamic_hash = calculate_sha256(dynamic_json_path)
-        json_hashes["_dynamic.json"] = dynamic_hash
-        print(f"[+] Stored hash of _dynamic.json: {dynamic_hash}")
-
-    if os.path.exists(dynamic_txt_path):
-        dynamic_txt_hash = calculate_sha256(dynamic_txt_path)
-        report_hashes["_dynamic.txt"] = dynamic_txt_hash
-        print(f"[+] Stored hash of _dynamic.txt: {dynamic_txt_hash}")
-
-    if os.path.exists(network_json_path):
-        network_hash = calculate_sha256(network_json_path)
-        json_hashes["_network.json"] = network_hash
-        print(f"[+] Stored hash of _network.json: {network_hash}")
-
-    if os.path.exists(network_txt_path):
-        network_txt_hash = calculate_sha256(network_txt_path)
-        report_hashes["_network.txt"] = network_txt_hash
-        print(
-            f"[+] Stored hash of _network.txt: {network_txt_hash}")
+    jobs.set_state(job_id, "detonating")
+    jobs.set_stages(job_id, dynamic="running", network="running")
+    try:
+        subprocess.run([PYTHON_EXE, MAIN_PY], check=True)
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"[-] Dynamic analysis failed: {e}")
+        jobs.set_stages(job_id, dynamic="failed", network="failed")
+        jobs.set_state(job_id, "failed", error=str(e)[:200])
+        return
+
+    jobs.set_state(job_id, "analyzing")
+    dynamic_done = os.path.exists(os.path.join(OUTPUT_FOLDER, "Sha256_dynamic.json"))
+    network_done = os.path.exists(os.path.join(OUTPUT_FOLDER, "sha256_net.json"))
 
     print("[*] Running rename...")
-    subprocess.run([PYTHON_EXE, RENAME_PY], check=True)
+    try:
+        subprocess.run([PYTHON_EXE, RENAME_PY], check=True)
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"[-] Rename failed: {e}")
+        dynamic_done = network_done = False
+
+    # Both stages come out of main.py, so they end together (one bundle)
+    jobs.set_stages(job_id, dynamic="done" if dynamic_done else "failed",
+                    network="done" if network_done else "failed")
+    jobs.set_state(job_id, "done")
 
     print("[✓] Pipeline finished successfully")
 
-    return {
-        "message": "Upload + extraction completed + analysis completed",
-    }
+
+def build_bundle(job_id, stages, path):
+    """
+    Pack the reports of `stages` into a tar.gz at `path`: the reports
+    named by kind (static.json, dynamic.txt, ...) and a manifest.json with
+    the sha256 and size of each. Returns the kinds packed.
+    """
+    manifest = {"sha256": job_id, "files": {}}
+    with tarfile.open(path, "w:gz") as tar:
+        for stage in stages:
+            for ext in REPORT_EXTENSIONS:
+                report_path = os.path.join(OUTPUT_FOLDER, f"{job_id}_{stage}{ext}")
+                if not os.path.exists(report_path):
+                    continue
+                kind = f"{stage}{ext}"
+                manifest["files"][kind] = {"sha256": calculate_sha256(report_path),
+                                           "size": os.path.getsize(report_path)}
+                tar.add(report_path, arcname=kind)
+
+        raw = json.dumps(manifest).encode()
+        info = tarfile.TarInfo("manifest.json")
+        info.size = len(raw)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(raw))
+    return list(manifest["files"])
+
+
+@app.get("/jobs/{job_id}/bundle")
+def get_bundle(job_id: str, stages: str = "static,dynamic,network"):
+    """
+    One compressed bundle with the reports of a job's stages (comma
+    separated), for the host to relay to Data Access in a single request.
+    X-Content-SHA256 is the digest of the bundle itself.
+    """
+    job_id = os.path.basename(job_id)
+    stages = [stage for stage in stages.split(",") if stage in STAGES]
+    fd, path = tempfile.mkstemp(suffix=".tar.gz")
+    os.close(fd)
+    try:
+        kinds = build_bundle(job_id, stages, path)
+    except Exception:
+        os.remove(path)
+        raise
+    if not kinds:
+        os.remove(path)
+        raise HTTPException(status_code=404, detail="No reports for these stages")
+
+    return FileResponse(
+        path=path,
+        media_type="application/gzip",
+        headers={"X-Content-SHA256": calculate_sha256(path),
+                 "X-Bundle-Files": ",".join(kinds)},
+        background=BackgroundTask(os.remove, path),
+    )
 
 
 @app.get("/json/{filename}")
@@ -177,22 +320,8 @@ def get_json_file(filename: str):
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to read JSON")
 
-    # Return the JSON content directly in the response, and the hash is stored in the json_hashes set for integrity verification
-
-    # Find the hash of the requested file in json_hashes set
-    # check if the filename ends with _static.json
-    file_hash = None
-    if filename.endswith("_static.json"):
-        hash = json_hashes["_static.json"] if "_static.json" in json_hashes else None
-    elif filename.endswith("_dynamic.json"):
-        hash = json_hashes["_dynamic.json"] if "_dynamic.json" in json_hashes else None
-    elif filename.endswith("_network.json"):
-        hash = json_hashes["_network.json"] if "_network.json" in json_hashes else None
-    else:
-        hash = None
-
-    # Return the JSON content along with the hash in the response
-    return JSONResponse(content={"data": data, "hash": hash})
+    # Return the JSON content along with the hash of the file for integrity verification
+    return JSONResponse(content={"data": data, "hash": calculate_sha256(filepath)})
 
 
 @app.get("/report/{filename}")
@@ -204,22 +333,13 @@ def get_report_file(filename: str):
     if not os.path.exists(filepath):
         raise HTTPException(status_code=404, detail="File not found")
 
-    # Find the hash of the requested file in report_hashes set
-    # check if the filename ends with _static.json
-    file_hash = None
-    if filename.endswith("_static.txt"):
-        hash = report_hashes["_static.txt"] if "_static.txt" in report_hashes else None
-    elif filename.endswith("_dynamic.txt"):
-        hash = report_hashes["_dynamic.txt"] if "_dynamic.txt" in report_hashes else None
-    elif filename.endswith("_network.txt"):
-        hash = report_hashes["_network.txt"] if "_network.txt" in report_hashes else None
-    else:
-        hash = None    # Return the file as a downloadable response
-
+    # Return the exact bytes on disk (any report, JSON included) with their
+    # hash, so the host can relay them without decoding
+    file_hash = calculate_sha256(filepath)
     return FileResponse(
         path=filepath,
         filename=safe_name,  # suggested download name
-        headers={"X-File-Hash": hash} if hash else None,
+        headers={"X-File-Hash": file_hash, "X-Content-SHA256": file_hash},
         media_type="application/octet-stream"  # generic binary type
     )
 
@@ -7,7 +7,7 @@ import PIL.Image  # Change this
 from pystray import Icon, Menu, MenuItem
 import webbrowser
 import requests
-from flask import Flask, json, request, render_template, redirect, url_for
+from flask import Flask, request, render_template, redirect, url_for, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
@@ -41,6 +41,9 @@ class SampleSchema(BaseModel):
     upload_date: datetime.datetime
     static_analysis: bool
     dynamic_analysis: bool
+    static_status: str = "queued"
+    dynamic_status: str = "queued"
+    network_status: str = "queued"
 
     class Config:
         arbitrary_types_allowed = True
@@ -75,25 +78,16 @@ def home():
     # Sort by date
     upload_timeline = sorted(upload_by_date.items())
 
-    # Fetch connected clients from data access service
+    # Fetch connected clients from the data access fleet view
     connected_clients = 0
     core_running = False
     try:
-        core_response = requests.get(
-            f'{DATA_ACCESS_SERVICE_URL}/core', timeout=5)
-        if core_response.status_code == 200:
-            core_data = core_response.json()
-            if core_data.get('status') != 'failed':
-
-                if core_data.get("clients")[0] == '':
-                    connected_clients = 0
-                else:
-                    connected_clients = len(core_data.get('clients', []))
-                core_running = True
-            else:
-                core_running = False
-        else:
-            core_running = False
+        fleet_response = requests.get(
+            f'{DATA_ACCESS_SERVICE_URL}/workers', timeout=5)
+        if fleet_response.status_code == 200:
+            totals = fleet_response.json().get('totals', {})
+            core_running = totals.get('cores', 0) > 0
+            connected_clients = totals.get('clients', 0)
     except Exception as e:
         print(f"Core clients fetch error: {e}")
         core_running = False
@@ -108,9 +102,12 @@ def upload():
     filename = secure_filename(file.filename)
 
     files = {"file": (filename, file.stream, file.content_type)}
+    # The submitter is used for fair-share scheduling of the analysis queue
+    data = {"priority": request.form.get("priority", "0"),
+            "submitter": request.remote_addr}
 
     try:
-        response = requests.post(SAMPLE_UPLOAD_API_URL, files=files)
+        response = requests.post(SAMPLE_UPLOAD_API_URL, files=files, data=data)
     except requests.RequestException as e:
         print(f"Error uploading file: {e}")
         return render_template('submit.html', filename=filename, error=True)
@@ -149,7 +146,6 @@ def analysis(sample_id):
                 resp = requests.get(sa_url, timeout=5)
                 if resp.status_code == 200:
                     static_analysis = resp.json()
-                    static_analysis = json.loads(static_analysis["content"])
 
             except Exception as e:
                 print(f"Static analysis fetch error: {e}")
@@ -161,7 +157,6 @@ def analysis(sample_id):
                 resp = requests.get(da_url, timeout=5)
                 if resp.status_code == 200:
                     dynamic_analysis = resp.json()
-                    dynamic_analysis = json.loads(dynamic_analysis["content"])
             except Exception as e:
                 print(f"Dynamic analysis fetch error: {e}")
                 dynamic_analysis = None
@@ -171,21 +166,58 @@ def analysis(sample_id):
         return 'Sample not found', 404
 
 
+@app.route('/analysis/<int:sample_id>/events')
+def analysis_events(sample_id):
+    """Relay the stage status events of a sample to the analysis page."""
+    response = requests.get(f'{SAMPLES_API_URL}{sample_id}', timeout=5)
+    if response.status_code != 200:
+        return 'Sample not found', 404
+    sha256 = response.json().get('hash_sha256')
+
+    try:
+        upstream = requests.get(
+            f'{DATA_ACCESS_SERVICE_URL}/samples/{sha256}/events', stream=True, timeout=60)
+        upstream.raise_for_status()
+    except requests.RequestException as e:
+        print(f"Status stream error: {e}")
+        return 'Status stream unavailable', 502
+
+    def relay():
+        with upstream:
+            for chunk in upstream.iter_content(chunk_size=None):
+                yield chunk
+
+    return Response(stream_with_context(relay()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
 @app.route('/submit', methods=['POST'])
 def submit():
 
     return redirect(url_for('home'))
 
 
+# History page status filter → data access ?status= value
+HISTORY_STATUS_FILTERS = {"completed": "analyzed", "pending": "pending"}
+
+
 @app.route("/history")
 def history():
 
-    response = requests.get(SAMPLES_API_URL)
+    params = {"limit": 25}
+    if request.args.get("cursor"):
+        params["cursor"] = request.args["cursor"]
+    status = HISTORY_STATUS_FILTERS.get(request.args.get("status"))
+    if status:
+        params["status"] = status
+
+    response = requests.get(SAMPLES_API_URL, params=params)
     response.raise_for_status()
 
     samples = [SampleSchema.model_validate(item) for item in response.json()]
 
-    return render_template('history.html', samples=samples)
+    return render_template('history.html', samples=samples,
+                           next_cursor=response.headers.get("X-Next-Cursor"))
 
 
 @app.route("/admin")
@@ -231,19 +263,13 @@ def admin():
     connected_clients = 0
     clients = []
     try:
-        response = requests.get(f'{DATA_ACCESS_SERVICE_URL}/core', timeout=5)
+        response = requests.get(f'{DATA_ACCESS_SERVICE_URL}/workers', timeout=5)
         if response.status_code == 200:
-            core_data = response.json()
-            if core_data.get('status') != 'failed':
-                core_running = True
-                clients_list = core_data.get("clients", [])
-                if clients_list and clients_list[0] != '':
-                    connected_clients = len(clients_list)
-                    clients = clients_list
-                else:
-                    connected_clients = 0
-            else:
-                core_running = False
+            workers = response.json().get('workers', [])
+            cores = [w for w in workers if w.get('role') == 'core']
+            core_running = bool(cores)
+            clients = [client for core in cores for client in core.get('clients', [])]
+            connected_clients = len(clients)
     except Exception as e:
         print(f"Core status fetch error: {e}")
         core_running = False